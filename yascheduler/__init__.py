@@ -3,9 +3,27 @@ from .variables import (
     CONFIG_FILE,
     LOG_FILE,
     PID_FILE,
+    CHUNKED_DOWNLOAD_CHUNK_SIZE,
+    CHUNKED_DOWNLOAD_THREADS,
+    CHUNKED_DOWNLOAD_THRESHOLD,
     SLEEP_INTERVAL,
-    N_IDLE_PASSES,
     DEFAULT_NODES_PER_PROVIDER,
+    ENGINE_MANIFEST_FILE,
+    FETCH_RETRY_DELAY,
+    FETCH_RETRY_MAX_DELAY,
+    FETCH_TIMEOUT,
+    NODE_BOOT_TIME,
+    NODE_IDLE_TIMEOUT,
+    NODE_IMAGE_FILE,
+    NODE_INVENTORY_TTL,
+    NODE_LEASE_TTL,
+    NODE_NCPUS_RETRY_DELAY,
+    NODE_RELEASE_MARGIN,
+    NOTIFY_CHANNEL,
+    SUBMIT_BATCH_SIZE,
+    TASK_PID_FILE,
+    TASK_RUNTIME,
+    WARM_POOL_WINDOW,
 )
 
 
@@ -23,6 +41,11 @@ def connect_db(config):
     return connection, cursor
 
 
+def notify_db(cursor, event):
+    "Wake up the scheduler daemon; delivered on transaction commit"
+    cursor.execute("SELECT pg_notify(%s, %s);", [NOTIFY_CHANNEL, event])
+
+
 def has_node(config, ip):
     connection, cursor = connect_db(config)
     cursor.execute("SELECT * FROM yascheduler_nodes WHERE ip=%s;", [ip])
@@ -45,6 +68,7 @@ def add_node(config, ip, ncpus=None, cloud=None, provisioned=False):
         "INSERT INTO yascheduler_nodes (ip, ncpus, cloud) VALUES (%s, %s, %s);",
         [ip, ncpus, cloud],
     )
+    notify_db(cursor, "node_added")
     connection.commit()
     connection.close()
     return True
@@ -53,6 +77,7 @@ def add_node(config, ip, ncpus=None, cloud=None, provisioned=False):
 def remove_node(config, ip):
     connection, cursor = connect_db(config)
     cursor.execute("DELETE FROM yascheduler_nodes WHERE ip=%s;", [ip])
+    notify_db(cursor, "node_removed")
     connection.commit()
     connection.close()
     return True
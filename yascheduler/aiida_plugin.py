@@ -8,6 +8,7 @@ from aiida.schedulers.datastructures import JobState, JobInfo, NodeNumberJobReso
 _MAP_STATUS_YASCHEDULER = {
     "QUEUED": JobState.QUEUED,
     "RUNNING": JobState.RUNNING,
+    "FETCHING": JobState.RUNNING,
     "FINISHED": JobState.DONE,
 }
 
@@ -70,6 +71,8 @@ class YaScheduler(aiida.schedulers.Scheduler):
         lines = []
         if job_tmpl.job_name:
             lines.append("LABEL={}".format(job_tmpl.job_name))
+        if job_tmpl.priority:
+            lines.append("PRIORITY={}".format(int(job_tmpl.priority)))
 
         # TODO too specific for engine.pcrystal
         lines += ["INPUT=INPUT", "STRUCT=fort.34"]
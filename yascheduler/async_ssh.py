@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Asynchronous SSH transport, an alternative to the paramiko one
+"""
+
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class AsyncSSH(object):
+    """
+    SSH operations of many nodes multiplexed on a single event loop,
+    which runs in a background thread. The connections are shared
+    by (host, user) and reopened on demand when closed.
+    Requires asyncssh (``pip install yascheduler[async]``).
+    """
+
+    _log: logging.Logger
+
+    def __init__(
+        self,
+        keys_dir: Optional[Path] = None,
+        keepalive_interval: int = 30,
+        max_channels: int = 8,
+        connect_timeout: float = 30,
+        logger: Optional[logging.Logger] = None,
+    ):
+        if logger:
+            self._log = logger.getChild(self.__class__.__name__)
+        else:
+            self._log = logging.getLogger(self.__class__.__name__)
+        try:
+            import asyncssh
+        except ImportError:
+            raise ImportError("asyncssh is required for ssh_backend = asyncssh")
+        self._asyncssh = asyncssh
+
+        self.keys_dir = keys_dir
+        self.keepalive_interval = keepalive_interval
+        self.max_channels = max_channels
+        self.connect_timeout = connect_timeout
+        self._connections: Dict[Tuple[str, str], Any] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._channels: Dict[str, asyncio.Semaphore] = {}
+        self._homes: Dict[Tuple[str, str], str] = {}
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="AsyncSSH", daemon=True
+        )
+        self._thread.start()
+
+    def _load_keys(self) -> List[Any]:
+        keys = []
+        if not self.keys_dir:
+            return keys
+        for path in sorted(self.keys_dir.iterdir()):
+            if not path.is_file() or path.name.startswith("."):
+                continue
+            try:
+                keys.append(self._asyncssh.read_private_key(str(path)))
+            except (OSError, self._asyncssh.KeyImportError):
+                pass
+        return keys
+
+    async def _connection(self, host: str, user: str) -> Any:
+        key = (host, user)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            conn = self._connections.get(key)
+            if conn is None or conn.is_closed():
+                # all the keys are offered within a single handshake
+                conn = await asyncio.wait_for(
+                    self._asyncssh.connect(
+                        host,
+                        username=user,
+                        client_keys=self._load_keys() or (),
+                        known_hosts=None,
+                        keepalive_interval=self.keepalive_interval,
+                    ),
+                    self.connect_timeout,
+                )
+                self._connections[key] = conn
+                self._homes.pop(key, None)
+            return conn
+
+    def _channel(self, host: str) -> asyncio.Semaphore:
+        if host not in self._channels:
+            self._channels[host] = asyncio.Semaphore(self.max_channels)
+        return self._channels[host]
+
+    async def run(
+        self, host: str, user: str, cmd: str, data: Optional[bytes] = None
+    ) -> Tuple[int, str, str]:
+        "Run :cmd: feeding :data: to its stdin"
+        async with self._channel(host):
+            conn = await self._connection(host, user)
+            if data is None:
+                result = await conn.run(
+                    cmd, stdin=self._asyncssh.DEVNULL, encoding=None
+                )
+            else:
+                result = await conn.run(cmd, input=data, encoding=None)
+        stdout = (result.stdout or b"").decode("utf-8", "replace")
+        stderr = (result.stderr or b"").decode("utf-8", "replace")
+        return result.exit_status, stdout, stderr
+
+    async def home(self, host: str, user: str) -> str:
+        "Remote working directory, which relative paths are resolved against"
+        if (host, user) not in self._homes:
+            _, stdout, _ = await self.run(host, user, "pwd")
+            self._homes[(host, user)] = stdout.strip()
+        return self._homes[(host, user)]
+
+    async def download(self, host: str, user: str, src: str, dst: Path) -> None:
+        "The blocks of a file are requested in parallel"
+        async with self._channel(host):
+            conn = await self._connection(host, user)
+            async with conn.start_sftp_client() as sftp:
+                try:
+                    await sftp.get(src, str(dst))
+                except self._asyncssh.SFTPNoSuchFile as err:
+                    raise FileNotFoundError(f"{src}: {err.reason}")
+                except self._asyncssh.SFTPError as err:
+                    raise IOError(f"{src}: {err.reason}")
+
+    async def delete(self, host: str, user: str, path: str) -> None:
+        async with self._channel(host):
+            conn = await self._connection(host, user)
+            async with conn.start_sftp_client() as sftp:
+                await sftp.rmtree(path, ignore_errors=True)
+
+    def call(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        "Wait for a single operation from a synchronous code"
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def gather(
+        self, coros: List[Awaitable[Any]], timeout: Optional[float] = None
+    ) -> List[Any]:
+        "Run many operations at once; failed ones result in exceptions"
+
+        async def run_all():
+            return await asyncio.gather(
+                *[asyncio.wait_for(coro, timeout) for coro in coros],
+                return_exceptions=True,
+            )
+
+        return asyncio.run_coroutine_threadsafe(run_all(), self._loop).result()
+
+    async def _close(self, host: Optional[str]) -> None:
+        keys = [k for k in self._connections if host is None or k[0] == host]
+        for key in keys:
+            conn = self._connections.pop(key)
+            conn.close()
+            await conn.wait_closed()
+
+    def close(self, host: Optional[str] = None) -> None:
+        "Close connections to :host: or all of them"
+        self.call(self._close(host))
+
+    def stop(self) -> None:
+        self.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -6,6 +6,7 @@ import logging
 import random
 import string
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import (
@@ -15,18 +16,62 @@ from dataclasses import asdict, dataclass, field
 from datetime import timedelta, datetime
 from importlib import import_module
 from pathlib import Path
+from threading import Lock
 from time import sleep
-from typing import Callable, List, Optional, Tuple, TypeVar, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
 from paramiko.rsakey import RSAKey
 from yascheduler.engine import EngineRepository
-from yascheduler.ssh import MyParamikoMachine
+from yascheduler.ssh import SSHPool
 import yascheduler.scheduler
-from yascheduler import DEFAULT_NODES_PER_PROVIDER
+from yascheduler import (
+    DEFAULT_NODES_PER_PROVIDER,
+    NODE_IDLE_TIMEOUT,
+    NODE_INVENTORY_TTL,
+    NODE_RELEASE_MARGIN,
+)
 
 T = TypeVar("T")
 
 
+class NodeInventory(object):
+    """
+    Provider resource ids of the nodes by ip. Filled on the node creation,
+    listed anew when outdated or on an unknown ip.
+    """
+
+    _lock: Lock
+    _ids: Dict[str, str]
+    _listed_at: Optional[datetime] = None
+
+    def __init__(self, ttl: int = NODE_INVENTORY_TTL):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._ids = {}
+
+    def get(self, ip: str, list_nodes: Callable[[], Dict[str, str]]) -> Optional[str]:
+        with self._lock:
+            outdated = not self._listed_at or (
+                datetime.now() - self._listed_at > timedelta(seconds=self.ttl)
+            )
+            if outdated or ip not in self._ids:
+                self._ids = list_nodes()
+                self._listed_at = datetime.now()
+            return self._ids.get(ip)
+
+    def set(self, ip: str, resource_id: str) -> None:
+        with self._lock:
+            self._ids[ip] = resource_id
+
+    def pop(self, ip: str) -> None:
+        with self._lock:
+            self._ids.pop(ip, None)
+
+
+# shared by the instances of a provider API
+_inventories: Dict[str, NodeInventory] = {}
+
+
 @dataclass
 class CloudConfig:
     bootcmd: List[Union[str, List[str]]] = field(default_factory=lambda: [])
@@ -47,7 +92,15 @@ class AbstractCloudAPI(object):
     _key_name: Optional[str] = None
     _public_key: Optional[str] = None
     max_nodes: Optional[int] = None
+    warm_min: int = 0
+    warm_max: int = 0
+    idle_timeout: int = NODE_IDLE_TIMEOUT
+    # seconds the nodes are billed by, if not by the second
+    billing_period: int = 0
     yascheduler: "Optional['yascheduler.scheduler.Yascheduler']" = None
+    _ssh_pool: Optional[SSHPool] = None
+    # name prefix or tag of the baked images
+    image_tag: str = "yascheduler-image"
 
     def __init__(
         self,
@@ -63,6 +116,18 @@ class AbstractCloudAPI(object):
             max_nodes if max_nodes is not None else DEFAULT_NODES_PER_PROVIDER
         )
         self.yascheduler = None
+        # idle nodes kept for the expected tasks
+        self.warm_min = config.getint("clouds", f"{self.name}_warm_min", fallback=0)
+        self.warm_max = max(
+            self.warm_min,
+            config.getint("clouds", f"{self.name}_warm_max", fallback=0),
+        )
+        self.idle_timeout = config.getint(
+            "clouds", f"{self.name}_idle_timeout", fallback=self.idle_timeout
+        )
+        self.billing_period = config.getint(
+            "clouds", f"{self.name}_billing_period", fallback=self.billing_period
+        )
 
         self.ssh_user = config.get(
             "clouds",
@@ -75,6 +140,15 @@ class AbstractCloudAPI(object):
             config.get("local", "keys_dir", fallback=local_data_dir / "keys")
         )
 
+    @property
+    def ssh_pool(self) -> SSHPool:
+        "SSH connections of the scheduler, or own ones if used standalone"
+        if self.yascheduler:
+            return self.yascheduler.ssh_pool
+        if not self._ssh_pool:
+            self._ssh_pool = SSHPool(keys_dir=self.local_keys_dir, logger=self._log)
+        return self._ssh_pool
+
     def _init_key(self) -> Tuple[str, str]:
         # try to load
         for filepath in self.local_keys_dir.iterdir():
@@ -161,19 +235,129 @@ class AbstractCloudAPI(object):
         "Run ssh command with retries on errors"
 
         def run_cmd():
-            machine = MyParamikoMachine.create_machine(
-                host=host,
-                user=self.ssh_user,
-                keys_dir=self.local_keys_dir,
-                connect_timeout=max_interval,
-            )
-            return machine.session().run(cmd)[1]
+            with self.ssh_pool.connection(
+                host, self.ssh_user, connect_timeout=max_interval
+            ) as machine, machine.session() as session:
+                return session.run(cmd)[1]
 
         return self._retry_with_backoff(run_cmd, max_time, max_interval)
 
+    def is_deallocatable(self, idle_time: float, age: float) -> bool:
+        """
+        Whether the node idle for :idle_time: seconds and created :age:
+        seconds ago is to be removed. The node billed by periods is kept
+        till the end of the paid period for the upcoming tasks.
+        """
+        if idle_time < self.idle_timeout:
+            return False
+        if not self.billing_period:
+            return True
+        paid_time_left = self.billing_period - age % self.billing_period
+        return paid_time_left <= NODE_RELEASE_MARGIN
+
+    def get_user_data(self, image: Optional[str] = None) -> str:
+        "cloud-config for a node booted from the baked :image: or a stock one"
+        data = self.cloud_config_data
+        if image:
+            # everything is installed already
+            data.package_upgrade = False
+            data.packages = []
+        return data.render()
+
+    def get_image(self) -> Optional[str]:
+        "Image baked for the current node setup, if any"
+        if not self.yascheduler:
+            return None
+        try:
+            image_hash = self.yascheduler.get_node_image_hash()
+            return self.list_images().get(image_hash)
+        except Exception as e:
+            self._log.warning(f"Can't find the baked image: {str(e)}")
+            return None
+
+    def bake_image(self) -> str:
+        """
+        Create the image of a node set up for the current engines,
+        so the new nodes are booted ready to run tasks.
+        The images baked for other setups are removed.
+        """
+        assert self.yascheduler
+        image_hash = self.yascheduler.get_node_image_hash()
+        images = self.list_images()
+        if image_hash in images:
+            self._log.info(f"Image {image_hash} is baked already")
+            return images[image_hash]
+
+        ip = self.create_node()
+        try:
+            self.setup_node(ip)
+            self._log.info(f"Baking image {image_hash} of {ip}...")
+            image_id = self.create_image(ip, image_hash)
+        finally:
+            self.delete_node(ip)
+        self._log.info(f"Image {image_hash} is baked: {image_id}")
+
+        for old_hash, old_id in images.items():
+            self._log.info(f"Removing old image {old_hash}...")
+            self.delete_image(old_id)
+        return image_id
+
+    def list_images(self) -> Dict[str, str]:
+        "Baked image ids by the node setup hash"
+        return {}
+
+    def create_image(self, ip: str, image_hash: str) -> str:
+        raise NotImplementedError()
+
+    def delete_image(self, image_id: str):
+        raise NotImplementedError()
+
+    @property
+    def inventory(self) -> NodeInventory:
+        return _inventories.setdefault(self.name, NodeInventory())
+
+    def get_node_id(self, ip: str) -> Optional[str]:
+        "Provider resource id of the node by its ip"
+        return self.inventory.get(ip, self.list_nodes)
+
+    def list_nodes(self) -> Dict[str, str]:
+        "Provider resource ids of all the nodes by ip"
+        raise NotImplementedError()
+
     def create_node(self) -> str:
         raise NotImplementedError()
 
+    def create_nodes(self, n: int) -> List[str]:
+        "Create :n: nodes at once; the failed ones are skipped"
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(self.create_node) for _ in range(n)]
+        ips = []
+        for future in futures:
+            try:
+                ips.append(future.result())
+            except Exception as e:
+                self._log.error(f"Node creation failed: {str(e)}")
+        return ips
+
+    def _wait_nodes(self, ips: List[str], wait: Callable[[str], Any]) -> List[str]:
+        "Wait for all the nodes up and ready at once; the rest are removed"
+        if not ips:
+            return []
+        with ThreadPoolExecutor(max_workers=len(ips)) as executor:
+            futures = {ip: executor.submit(wait, ip) for ip in ips}
+        ready = []
+        for ip, future in futures.items():
+            err = future.exception()
+            if err is None:
+                ready.append(ip)
+                continue
+            self._log.error(f"Node {ip} is not ready: {str(err)}")
+            try:
+                self.delete_node(ip)
+            except Exception as e:
+                self._log.error(f"Can't remove {ip}: {str(e)}")
+        return ready
+
     def setup_node(self, ip):
         """Provision a debian-like node"""
         if self.yascheduler:
@@ -38,6 +38,7 @@ import json
 import logging
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from pathlib import Path
 from threading import Lock
@@ -45,6 +46,12 @@ from typing import cast, Any, Dict, List, NamedTuple, Optional, Union
 
 from azure.identity import ClientSecretCredential
 from azure.mgmt.compute.v2021_07_01 import ComputeManagementClient
+from azure.mgmt.compute.v2021_07_01.models import (
+    HyperVGenerationTypes,
+    Image,
+    SubResource,
+    VirtualMachine,
+)
 from azure.mgmt.compute.v2021_07_01.operations import VirtualMachinesOperations
 from azure.mgmt.network.v2020_06_01 import NetworkManagementClient
 from azure.mgmt.network.v2020_06_01.models import PublicIPAddress
@@ -137,6 +144,10 @@ class AzurePubIPNotFoundError(AzureNotFoundError):
     resource_type = "Public IP Address"
 
 
+class AzureVMNotFoundError(AzureNotFoundError):
+    resource_type = "Virtual Machine of"
+
+
 class AzureCreateError(Exception):
     resource_type: Optional[str] = None
 
@@ -304,15 +315,19 @@ class AzureAPI(AbstractCloudAPI):
         res = self.create_deployment(name, tmpl, self.infra_params)
         return res.properties and res.properties.outputs or {}
 
-    def create_vm_deployment(self, infra_outputs) -> Dict[str, Any]:
+    def create_vm_deployment(
+        self, infra_outputs, image_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         "Create deployment with VM parts"
         rnd_id = "".join([random.choice(string.ascii_lowercase) for _ in range(8)])
         name = self.vm_deployment_name_tmpl.format(self.rg_name, rnd_id)
         params = {
             "namePrefix": rnd_id,
             "adminPublicKey": self.public_key,
-            "customData": self.cloud_config_data.render(),
+            "customData": self.get_user_data(image_id),
         }
+        if image_id:
+            params["imageId"] = image_id
         # inherit params from infra deployment outputs
         inherit_infra_params = [
             "projectName",
@@ -332,13 +347,15 @@ class AzureAPI(AbstractCloudAPI):
         res = self.create_deployment(name, tmpl, params)
         return res.properties and res.properties.outputs or {}
 
-    def create_node(self):
+    def _create_infra(self) -> Dict[str, Any]:
         infra_deployment_lock.acquire()
         try:
-            infra_outputs = self.create_infra_deployment()
+            return self.create_infra_deployment()
         finally:
             infra_deployment_lock.release()
-        vm_outputs = self.create_vm_deployment(infra_outputs)
+
+    def _create_vm(self, infra_outputs, image_id: Optional[str]) -> str:
+        vm_outputs = self.create_vm_deployment(infra_outputs, image_id)
 
         ip_name: Optional[str] = vm_outputs.get("publicIpAddressName", {}).get("value")
         if not ip_name:
@@ -346,13 +363,122 @@ class AzureAPI(AbstractCloudAPI):
         ip_address = self.get_pip(ip_name).ip_address
         if not ip_address:
             raise AzureCreatedVMPublicIPNotFoundError()
+        self.inventory.set(ip_address, ip_name)
+        return ip_address
+
+    def _wait_ready(self, ip: str):
+        self._run_ssh_cmd_with_backoff(ip, cmd="cloud-init status --wait", max_time=600)
+
+    def create_node(self):
+        ip_address = self._create_vm(self._create_infra(), self.get_image())
 
         # wait node up and ready
+        self._wait_ready(ip_address)
+
+        return ip_address
+
+    def create_nodes(self, n: int) -> List[str]:
+        infra_outputs = self._create_infra()
+        image_id = self.get_image()
+        # the VM deployments are run in parallel
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [
+                executor.submit(self._create_vm, infra_outputs, image_id)
+                for _ in range(n)
+            ]
+        ips = []
+        for future in futures:
+            try:
+                ips.append(future.result())
+            except Exception as e:
+                self._log.error(f"Node creation failed: {str(e)}")
+        return self._wait_nodes(ips, self._wait_ready)
+
+    def list_nodes(self) -> Dict[str, str]:
+        pips = self.network_client.public_ip_addresses.list(self.rg_name)
+        return {
+            cast(str, i.ip_address): cast(str, i.name)
+            for i in cast(List[PublicIPAddress], pips)
+            if i.ip_address
+        }
+
+    def get_node_pip(self, ip: str) -> Optional[PublicIPAddress]:
+        "Public IP Address of the node"
+        # the name is listed anew if the address is released meanwhile
+        for _ in range(2):
+            name = self.get_node_id(ip)
+            if not name:
+                return None
+            try:
+                pip_obj = self.get_pip(name)
+            except AzurePubIPNotFoundError:
+                pip_obj = None
+            if pip_obj and pip_obj.ip_address == ip:
+                return pip_obj
+            self.inventory.pop(ip)
+        return None
+
+    def get_vm(self, ip: str) -> VirtualMachine:
+        "Find VM by its Public IP Address"
+        pip_obj = self.get_node_pip(ip)
+        if not pip_obj:
+            raise AzurePubIPNotFoundError(ip)
+        pip_tags = cast(Dict[str, str], pip_obj.tags) or {}
+        deployment_name = self.vm_deployment_name_tmpl.format(
+            self.rg_name, pip_tags.get("DeploymentId")
+        )
+        deployment = self.resource_client.deployments.get(self.rg_name, deployment_name)
+        deps = (
+            cast(
+                Union[List[Dependency], None],
+                deployment.properties and deployment.properties.dependencies,
+            )
+            or []
+        )
+        for d in deps:
+            if d.resource_name and (
+                d.resource_type == "Microsoft.Compute/virtualMachines"
+            ):
+                return self.compute_client.virtual_machines.get(
+                    self.rg_name, d.resource_name
+                )
+        raise AzureVMNotFoundError(ip)
+
+    def list_images(self) -> Dict[str, str]:
+        images = {}
+        for i in self.compute_client.images.list_by_resource_group(self.rg_name):
+            image_hash = (i.tags or {}).get(self.image_tag)
+            if image_hash:
+                images[image_hash] = cast(str, i.id)
+        return images
+
+    def create_image(self, ip, image_hash):
+        # the user and the data are kept
         self._run_ssh_cmd_with_backoff(
-            ip_address, cmd="cloud-init status --wait", max_time=600
+            ip, cmd="sudo waagent -force -deprovision && sync"
         )
+        vm = self.get_vm(ip)
+        vm_name = cast(str, vm.name)
+        self._log.info(f"Deallocating {vm_name}...")
+        self.compute_client.virtual_machines.begin_deallocate(
+            self.rg_name, vm_name
+        ).result()
+        self.compute_client.virtual_machines.generalize(self.rg_name, vm_name)
+        image = self.compute_client.images.begin_create_or_update(
+            self.rg_name,
+            f"{self.image_tag}-{image_hash}",
+            Image(
+                location=cast(str, vm.location),
+                source_virtual_machine=SubResource(id=vm.id),
+                hyper_v_generation=HyperVGenerationTypes.V2,
+                tags={self.image_tag: image_hash},
+            ),
+        ).result()
+        return cast(str, image.id)
 
-        return ip_address
+    def delete_image(self, image_id):
+        name = image_id.rsplit("/", 1)[-1]
+        self.compute_client.images.begin_delete(self.rg_name, name).result()
 
     def _run_del_reqs(self, reqs: List[DeleteRequest]) -> None:
         for req in sorted(reqs, key=lambda x: x[0]):
@@ -367,20 +493,15 @@ class AzureAPI(AbstractCloudAPI):
         del_reqs: List[DeleteRequest] = []
 
         # find Public IP Address
-        pip_obj = None
-        for i in self.network_client.public_ip_addresses.list(self.rg_name):
-            i = cast(PublicIPAddress, i)
-            if i.ip_address != ip:
-                continue
-            pip_obj = i
-            req = DeleteRequest(
-                99, self.network_client.public_ip_addresses, cast(str, i.name)
-            )
-            del_reqs.append(req)
-
+        pip_obj = self.get_node_pip(ip)
         if not pip_obj:
             self._log.error(f"Public IP {ip} not found")
             return
+        self.inventory.pop(ip)
+        req = DeleteRequest(
+            99, self.network_client.public_ip_addresses, cast(str, pip_obj.name)
+        )
+        del_reqs.append(req)
         pip_tags = cast(Dict[str, str], pip_obj.tags) or {}
 
         # find Deployment
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 import logging
+import math
 import queue
 import random
+from collections import Counter
 from configparser import NoSectionError
-from typing import Dict, List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 from .abstract_cloud_api import AbstractCloudAPI, load_cloudapi
 from .workers import (
@@ -16,6 +19,7 @@ from .workers import (
     DeallocateTask,
     DeallocatorWorker,
 )
+from yascheduler import notify_db, NODE_BOOT_TIME, TASK_RUNTIME, WARM_POOL_WINDOW
 import yascheduler.scheduler
 
 for logger_name in [
@@ -32,8 +36,10 @@ class CloudAPIManager(object):
     _deallocators: List[DeallocatorWorker]
     _deallocate_tasks: "queue.Queue[DeallocateTask]"
     _deallocate_results: "queue.Queue[DeallocateResult]"
+    _allocating: Dict[str, datetime]
     apis: Dict[str, AbstractCloudAPI]
     yascheduler: "Optional['yascheduler.scheduler.Yascheduler']"
+    boot_time: float
 
     def __init__(self, config, logger: Optional[logging.Logger] = None):
         if logger:
@@ -42,7 +48,12 @@ class CloudAPIManager(object):
             self._log = logging.getLogger(self.__class__.__name__)
         self.apis = {}
         self.yascheduler = None
-        self.tasks = set()
+        self.warm_pool_window = int(
+            config.get("local", "warm_pool_window", fallback=WARM_POOL_WINDOW)
+        )
+        # creation times of the nodes being allocated by their temporary ips
+        self._allocating = {}
+        self.boot_time = NODE_BOOT_TIME
         active_providers = set()
 
         try:
@@ -118,7 +129,8 @@ class CloudAPIManager(object):
         for t in self._deallocators:
             t.start()
 
-    def allocate_node(self) -> str:
+    def _reserve_node(self, name: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        "Temporary node of the given or the least used provider"
         assert self.yascheduler
         c = self.yascheduler.cursor
         active_providers = list(self.apis.keys())
@@ -141,11 +153,15 @@ class CloudAPIManager(object):
 
         if not active_providers:
             self._log.warning("No suitable cloud provides")
+            return None
 
         self._log.info("Enabled: %s" % str(active_providers))
         self._log.info("In use : %s" % str(used_providers))
 
-        if len(used_providers) < len(active_providers):
+        if name:
+            if name not in active_providers:
+                return None
+        elif len(used_providers) < len(active_providers):
             name = random.choice(
                 list(set(active_providers) - set([x[0] for x in used_providers]))
             )
@@ -164,16 +180,31 @@ class CloudAPIManager(object):
             [cloudapi.name],
         )
 
-        t = AllocateTask(api_name=cloudapi.name, tmp_ip=c.fetchone()[0])
-        self._allocate_tasks.put(t)
+        return cloudapi.name, c.fetchone()[0]
+
+    def allocate_nodes(self, n: int, name: Optional[str] = None) -> List[str]:
+        """
+        Allocate :n: nodes with the given or the least used providers.
+        The nodes of a provider are created at once by an allocator.
+        """
+        assert self.yascheduler
+        batches: Dict[str, List[str]] = {}
+        for _ in range(n):
+            reserved = self._reserve_node(name)
+            if not reserved:
+                break
+            api_name, tmp_ip = reserved
+            batches.setdefault(api_name, []).append(tmp_ip)
+            self._allocating[tmp_ip] = datetime.now()
         self.yascheduler.connection.commit()
-        return t.tmp_ip
+        for api_name, tmp_ips in batches.items():
+            self._allocate_tasks.put(AllocateTask(api_name=api_name, tmp_ips=tmp_ips))
+        return [tmp_ip for tmp_ips in batches.values() for tmp_ip in tmp_ips]
 
-    def allocate(self, on_task):
-        if on_task in self.tasks:
-            return
-        self.tasks.add(on_task)
-        self.allocate_node()
+    def allocate_node(self, name: Optional[str] = None) -> Optional[str]:
+        "Allocate a node with the given or the least used provider"
+        tmp_ips = self.allocate_nodes(1, name)
+        return tmp_ips[0] if tmp_ips else None
 
     def process_allocated(self):
         assert self.yascheduler
@@ -185,14 +216,21 @@ class CloudAPIManager(object):
                 break
 
             c.execute("DELETE FROM yascheduler_nodes WHERE ip=%s;", [r.tmp_ip])
+            started = self._allocating.pop(r.tmp_ip, None)
+            elapsed = started and (datetime.now() - started).total_seconds() or 0
+            if r.ip and r.provisioned and started:
+                # moving average of the node creation time
+                self.boot_time += 0.2 * (elapsed - self.boot_time)
             if r.ip and r.provisioned:
+                # the node is billed since its creation
                 c.execute(
                     """
-                    INSERT INTO yascheduler_nodes (ip, ncpus, cloud)
-                    VALUES (%s, %s, %s);
+                    INSERT INTO yascheduler_nodes (ip, ncpus, cloud, created_at)
+                    VALUES (%s, %s, %s, NOW() - %s * INTERVAL '1 second');
                     """,
-                    [r.ip, r.ncpus, r.api_name],
+                    [r.ip, r.ncpus, r.api_name, elapsed],
                 )
+                notify_db(c, "node_added")
             if r.ip and not r.provisioned:
                 self.deallocate([r.ip])
 
@@ -232,14 +270,163 @@ class CloudAPIManager(object):
             self.yascheduler.connection.commit()
             self._deallocate_results.task_done()
 
+    def get_deallocatable(self, free_nodes: List[str]) -> List[str]:
+        "Free cloud nodes to remove by the policies of their providers"
+        assert self.yascheduler
+        if not free_nodes:
+            return []
+        c = self.yascheduler.cursor
+        c.execute(
+            """
+            SELECT ip, cloud,
+                EXTRACT(EPOCH FROM NOW() - last_busy_at),
+                EXTRACT(EPOCH FROM NOW() - created_at)
+            FROM yascheduler_nodes
+            WHERE cloud IS NOT NULL AND enabled=TRUE AND ip = ANY(%s);
+            """,
+            [free_nodes],
+        )
+        ips = []
+        for ip, cloud, idle_time, age in c.fetchall():
+            cloudapi = self.apis.get(cloud)
+            if cloudapi and cloudapi.is_deallocatable(float(idle_time), float(age)):
+                ips.append(ip)
+        return ips
+
     def do_async_work(self):
         self.process_allocated()
         self.process_deallocated()
 
-    def get_capacity(self, resources):
-        n_busy_cloud_nodes = len(
-            [item for item in resources if item[3]]
-        )  # Yascheduler.queue_get_resources()
-        max_nodes = sum([self.apis[cloudapi].max_nodes for cloudapi in self.apis])
-        diff = max_nodes - n_busy_cloud_nodes
-        return diff if diff > 0 else 0
+    def get_arrival_rate(self) -> float:
+        "Tasks submitted per second recently"
+        assert self.yascheduler
+        c = self.yascheduler.cursor
+        c.execute(
+            """
+            SELECT COUNT(*) FROM yascheduler_tasks
+            WHERE submitted_at > NOW() - %s * INTERVAL '1 second';
+            """,
+            [self.warm_pool_window],
+        )
+        return c.fetchone()[0] / self.warm_pool_window
+
+    def get_warm_targets(self) -> Dict[str, int]:
+        """
+        Number of idle nodes to keep by provider: enough for the tasks
+        expected while a new node is being created, within the provider
+        warm_min and warm_max.
+        """
+        targets = {name: api.warm_min for name, api in self.apis.items()}
+        if not any(api.warm_max for api in self.apis.values()):
+            return targets
+        demand = math.ceil(self.get_arrival_rate() * self.boot_time)
+        demand -= sum(targets.values())
+        while demand > 0:
+            room = [
+                name for name, api in self.apis.items() if targets[name] < api.warm_max
+            ]
+            if not room:
+                break
+            for name in room[:demand]:
+                targets[name] += 1
+            demand -= len(room)
+        return targets
+
+    def get_task_runtime(self) -> float:
+        "Average run time of the recent tasks in seconds"
+        assert self.yascheduler
+        c = self.yascheduler.cursor
+        c.execute(
+            """
+            SELECT EXTRACT(EPOCH FROM AVG(finished_at - started_at)) FROM (
+                SELECT started_at, finished_at FROM yascheduler_tasks
+                WHERE finished_at IS NOT NULL AND started_at IS NOT NULL
+                ORDER BY finished_at DESC LIMIT 100
+            ) AS recent;
+            """
+        )
+        runtime = c.fetchone()[0]
+        return max(float(runtime), 1) if runtime is not None else TASK_RUNTIME
+
+    def get_backlog_nodes(self, n_nodes: int) -> int:
+        """
+        Number of nodes worth creating for the queued tasks. The :n_nodes:
+        present nodes drain the queue while a new node boots, and every
+        new node should get at least its boot time of work.
+        """
+        assert self.yascheduler
+        c = self.yascheduler.cursor
+        c.execute(
+            "SELECT COUNT(*) FROM yascheduler_tasks WHERE status=%s;",
+            [self.yascheduler.STATUS_TO_DO],
+        )
+        backlog = c.fetchone()[0]
+        if not backlog:
+            return 0
+        runtime = self.get_task_runtime()
+        backlog -= n_nodes * self.boot_time / runtime
+        if backlog <= 0:
+            return 0
+        return min(math.ceil(backlog), math.ceil(backlog * runtime / self.boot_time))
+
+    def autoscale(self, free_nodes: List[str]) -> List[str]:
+        """
+        Allocate the nodes for the queued tasks and the nodes missing
+        in the warm pool. Returns the free nodes to keep warm.
+        The warm pool is shared by all the daemons: the idle nodes
+        are counted from the database, and the same of them are kept.
+        Nothing is allocated above the providers max_nodes.
+        """
+        assert self.yascheduler
+        if not self.apis:
+            return []
+        c = self.yascheduler.cursor
+        c.execute(
+            """
+            SELECT n.ip, n.enabled, n.cloud, NOT EXISTS (
+                SELECT 1 FROM yascheduler_tasks AS t
+                WHERE t.ip=n.ip AND t.status IN (%s, %s)
+            )
+            FROM yascheduler_nodes AS n ORDER BY n.ip;
+            """,
+            (self.yascheduler.STATUS_RUNNING, self.yascheduler.STATUS_FETCHING),
+        )
+        idle_nodes: Dict[str, List[str]] = {}
+        pending: "Counter[str]" = Counter()
+        cloud_nodes: "Counter[str]" = Counter()
+        n_nodes = 0
+        for ip, enabled, cloud, idle in c.fetchall():
+            if cloud:
+                cloud_nodes[cloud] += 1
+            if "." not in ip:  # NB provision nodes have fake ips
+                pending[cloud] += 1
+                continue
+            if enabled:
+                n_nodes += 1
+                if idle:
+                    idle_nodes.setdefault(cloud, []).append(ip)
+
+        room = {
+            name: max(0, api.max_nodes - cloud_nodes[name])
+            for name, api in self.apis.items()
+        }
+        capacity = sum(room.values())
+
+        # the nodes being created are taken by the queued tasks first
+        waiting = self.get_backlog_nodes(n_nodes) if capacity else 0
+        missing = min(waiting - sum(pending.values()), capacity)
+        if missing > 0:
+            self._log.info(f"Scaling up by {missing} nodes for the queued tasks")
+            capacity -= len(self.allocate_nodes(missing))
+
+        warm_nodes = []
+        for name, target in self.get_warm_targets().items():
+            idle = idle_nodes.get(name, [])
+            warm_nodes.extend(ip for ip in idle[:target] if ip in free_nodes)
+            taken = min(waiting, pending[name])
+            waiting -= taken
+            missing = target - len(idle) - pending[name] + taken
+            missing = min(missing, room[name], capacity)
+            if missing > 0:
+                capacity -= len(self.allocate_nodes(missing, name))
+        return warm_nodes
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
 from configparser import ConfigParser
-from typing import Optional
+from typing import Dict, List, Optional
 
 from hcloud import Client, APIException
 from hcloud.images.domain import Image
+from hcloud.servers.client import BoundServer
 from hcloud.server_types.domain import ServerType
 from hcloud.ssh_keys.domain import SSHKey
 
@@ -14,6 +15,7 @@ from yascheduler.clouds import AbstractCloudAPI
 class HetznerCloudAPI(AbstractCloudAPI):
 
     name = "hetzner"
+    billing_period = 3600
 
     client: Client
     _ssh_key_id: Optional[int] = None
@@ -42,38 +44,92 @@ class HetznerCloudAPI(AbstractCloudAPI):
                     raise
         return self._ssh_key_id
 
-    def create_node(self):
+    def _create_server(self, image_id: Optional[str]) -> str:
         response = self.client.servers.create(
             name=self.get_rnd_name("node"),
             server_type=ServerType("cx51"),
-            image=Image(name="debian-10"),
+            image=Image(id=int(image_id)) if image_id else Image(name="debian-10"),
             ssh_keys=[SSHKey(id=self.ssh_key_id, name=self.key_name)],
-            user_data=self.cloud_config_data.render(),
+            user_data=self.get_user_data(image_id),
         )
         server = response.server
         ip = server.public_net.ipv4.ip
+        self.inventory.set(ip, str(server.id))
         self._log.info("CREATED %s" % ip)
+        return ip
 
-        # wait node up and ready
+    def _wait_ready(self, ip: str):
         self._run_ssh_cmd_with_backoff(
             ip, cmd="cloud-init status --wait", max_interval=5
         )
 
+    def create_node(self):
+        ip = self._create_server(self.get_image())
+
+        # wait node up and ready
+        self._wait_ready(ip)
+
         return ip
 
+    def create_nodes(self, n: int) -> List[str]:
+        image_id = self.get_image()
+        ips = []
+        for _ in range(n):
+            try:
+                ips.append(self._create_server(image_id))
+            except Exception as e:
+                self._log.error(f"Node creation failed: {str(e)}")
+                break
+        return self._wait_nodes(ips, self._wait_ready)
+
     def delete_key(self):
         self.client.ssh_keys.delete(SSHKey(id=self.ssh_key_id))
 
-    def delete_node(self, ip):
-        server = None
+    def list_nodes(self) -> Dict[str, str]:
+        return {s.public_net.ipv4.ip: str(s.id) for s in self.client.servers.get_all()}
+
+    def get_server(self, ip) -> Optional[BoundServer]:
+        server_id = self.get_node_id(ip)
+        if not server_id:
+            return None
+        try:
+            return self.client.servers.get_by_id(int(server_id))
+        except APIException as ex:
+            if ex.code != "not_found":
+                raise
+            self.inventory.pop(ip)
+            return None
+
+    def list_images(self) -> Dict[str, str]:
+        images = self.client.images.get_all(
+            type=["snapshot"], label_selector=self.image_tag
+        )
+        return {x.labels[self.image_tag]: str(x.id) for x in images}
+
+    def create_image(self, ip, image_hash):
+        server = self.get_server(ip)
+        if not server:
+            raise RuntimeError(f"Server {ip} not found")
+        # consistent snapshot of the disk
+        server.power_off().wait_until_finished()
+        response = self.client.servers.create_image(
+            server,
+            description=f"{self.image_tag}-{image_hash}",
+            type="snapshot",
+            labels={self.image_tag: image_hash},
+        )
+        response.action.wait_until_finished(max_retries=600)
+        return str(response.image.id)
 
-        for s in self.client.servers.get_all():
-            if s.public_net.ipv4.ip == ip:
-                server = self.client.servers.get_by_id(s.id)
-                break
+    def delete_image(self, image_id):
+        self.client.images.delete(Image(id=int(image_id)))
+
+    def delete_node(self, ip):
+        server = self.get_server(ip)
 
         if server:
             server.delete()
+            self.inventory.pop(ip)
             self._log.info("DELETED %s" % ip)
 
         else:
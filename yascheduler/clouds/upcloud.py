@@ -1,8 +1,9 @@
 import time
 from configparser import ConfigParser
-from typing import Dict
+from typing import Dict, List, Optional
 
 from upcloud_api import CloudManager, Server, Storage, ZONE, login_user_block
+from upcloud_api import UpCloudAPIError
 
 from yascheduler.clouds import AbstractCloudAPI
 
@@ -10,6 +11,7 @@ from yascheduler.clouds import AbstractCloudAPI
 class UpCloudAPI(AbstractCloudAPI):
 
     name = "upcloud"
+    billing_period = 3600
 
     client: CloudManager
 
@@ -24,7 +26,11 @@ class UpCloudAPI(AbstractCloudAPI):
         )
         self.client.authenticate()
 
-    def create_node(self):
+    def _create_server(self, image_id: Optional[str]) -> str:
+        if image_id:
+            storage = Storage(uuid=image_id, size=40)
+        else:
+            storage = Storage(os="Debian 10.0", size=40)
         login_user = login_user_block(
             username=self.ssh_user,
             ssh_keys=[self.public_key] if self.public_key else [],
@@ -36,34 +42,103 @@ class UpCloudAPI(AbstractCloudAPI):
                 memory_amount=4096,
                 hostname=self.get_rnd_name("node"),
                 zone=ZONE.London,
-                storage_devices=[Storage(os="Debian 10.0", size=40)],
+                storage_devices=[storage],
                 login_user=login_user,
             )
         )
         ip = server.get_public_ip()
+        self.inventory.set(ip, server.uuid)
         self._log.info("CREATED %s" % ip)
+        return ip
+
+    def _wait_ready(self, ip: str):
+        self._run_ssh_cmd_with_backoff(ip, cmd="whoami", max_time=60, max_interval=5)
+
+    def create_node(self):
+        ip = self._create_server(self.get_image())
         self._log.info("WAITING FOR START...")
         time.sleep(30)
-        self._run_ssh_cmd_with_backoff(ip, cmd="whoami", max_time=60, max_interval=5)
+        self._wait_ready(ip)
 
         return ip
 
-    def delete_node(self, ip):
-        for server in self.client.get_servers():
-            if server.get_public_ip() == ip:
-                server.stop()
-                self._log.info("WAITING FOR STOP...")
-                time.sleep(20)
-                while True:
-                    try:
-                        server.destroy()
-                    except:
-                        time.sleep(5)
-                    else:
-                        break
-                for storage in server.storage_devices:
-                    storage.destroy()
-                self._log.info("DELETED %s" % ip)
+    def create_nodes(self, n: int) -> List[str]:
+        image_id = self.get_image()
+        ips = []
+        for _ in range(n):
+            try:
+                ips.append(self._create_server(image_id))
+            except Exception as e:
+                self._log.error(f"Node creation failed: {str(e)}")
                 break
+        if ips:
+            self._log.info("WAITING FOR START...")
+            time.sleep(30)
+        return self._wait_nodes(ips, self._wait_ready)
+
+    def list_nodes(self) -> Dict[str, str]:
+        return {x.get_public_ip(): x.uuid for x in self.client.get_servers()}
+
+    def get_server(self, ip) -> Optional[Server]:
+        uuid = self.get_node_id(ip)
+        if not uuid:
+            return None
+        try:
+            return self.client.get_server(uuid)
+        except UpCloudAPIError as e:
+            if e.error_code != "SERVER_NOT_FOUND":
+                raise
+            self.inventory.pop(ip)
+            return None
+
+    def list_images(self) -> Dict[str, str]:
+        prefix = self.image_tag + "-"
+        return {
+            x.title[len(prefix) :]: x.uuid
+            for x in self.client.get_storages("template")
+            if x.title.startswith(prefix)
+        }
+
+    def create_image(self, ip, image_hash):
+        server = self.get_server(ip)
+        if not server:
+            raise RuntimeError(f"Server {ip} not found")
+        server.stop()
+        self._log.info("WAITING FOR STOP...")
+        time.sleep(20)
+        storage = self._retry_with_backoff(
+            lambda: self.client.templatize_storage(
+                server.storage_devices[0].uuid, f"{self.image_tag}-{image_hash}"
+            ),
+            max_time=120,
+        )
+
+        def wait_online():
+            if self.client.get_storage(storage.uuid).state != "online":
+                raise RuntimeError(f"Template {storage.uuid} is not ready")
+
+        self._retry_with_backoff(wait_online, max_time=1800, max_interval=30)
+        return storage.uuid
+
+    def delete_image(self, image_id):
+        self.client.delete_storage(image_id)
+
+    def delete_node(self, ip):
+        server = self.get_server(ip)
+        if server:
+            server.stop()
+            self._log.info("WAITING FOR STOP...")
+            time.sleep(20)
+            while True:
+                try:
+                    server.destroy()
+                except:
+                    time.sleep(5)
+                else:
+                    break
+            for storage in server.storage_devices:
+                storage.destroy()
+            self.inventory.pop(ip)
+            self._log.info("DELETED %s" % ip)
         else:
             self._log.info("NODE %s NOT DELETED AS UNKNOWN" % ip)
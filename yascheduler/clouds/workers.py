@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import queue
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from dataclasses import dataclass
 from typing import Dict, List, Optional
@@ -35,7 +36,7 @@ class CloudWorker(BackgroundWorker):
 @dataclass
 class AllocateTask:
     api_name: str
-    tmp_ip: str
+    tmp_ips: List[str]
 
 
 @dataclass
@@ -67,7 +68,9 @@ class AllocatorWorker(CloudWorker):
         except queue.Empty:
             return
 
-        r = AllocateResult(api_name=t.api_name, tmp_ip=t.tmp_ip)
+        results = [
+            AllocateResult(api_name=t.api_name, tmp_ip=tmp_ip) for tmp_ip in t.tmp_ips
+        ]
 
         api = self._apis.get(t.api_name)
         if not api:
@@ -76,19 +79,36 @@ class AllocatorWorker(CloudWorker):
             return
 
         try:
-            self._log.info("Creating a node...")
-            r.ip = api.create_node()
-            self._log.info(f"Created: {r.ip}")
-            api.setup_node(r.ip)
-            self._log.info(f"Provisioned: {r.ip}")
-            r.provisioned = True
-            self._sleep_interval = SLEEP_INTERVAL
+            self._log.info(f"Creating {len(results)} nodes...")
+            ips = api.create_nodes(len(results))
+            self._log.info(f"Created: {', '.join(ips) or '-'}")
         except Exception as e:
-            self._log.error(f"Allocation of {t.tmp_ip} failed: {str(e)}")
+            self._log.error(f"Allocation of {', '.join(t.tmp_ips)} failed: {str(e)}")
+            ips = []
+        for r, ip in zip(results, ips):
+            r.ip = ip
+
+        def setup(r: AllocateResult) -> None:
+            try:
+                api.setup_node(r.ip)
+                self._log.info(f"Provisioned: {r.ip}")
+                r.provisioned = True
+            except Exception as e:
+                self._log.error(f"Provisioning of {r.ip} failed: {str(e)}")
+
+        created = [r for r in results if r.ip]
+        if created:
+            with ThreadPoolExecutor(max_workers=len(created)) as executor:
+                list(executor.map(setup, created))
+
+        if all(r.provisioned for r in results):
+            self._sleep_interval = SLEEP_INTERVAL
+        else:
             # backoff
             self._sleep_interval = min(self._sleep_interval * 1.3, 60)
 
-        self._result_queue.put(r)
+        for r in results:
+            self._result_queue.put(r)
         self._task_queue.task_done()
 
 
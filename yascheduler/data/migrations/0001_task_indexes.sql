@@ -0,0 +1,9 @@
+-- status counters and lookups by status
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_status_idx
+    ON yascheduler_tasks (status);
+-- tasks to do (status=0)
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_to_do_idx
+    ON yascheduler_tasks (task_id) WHERE status = 0;
+-- running (status=1) and fetching (status=3) tasks by node
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_running_ip_idx
+    ON yascheduler_tasks (ip) WHERE status IN (1, 3);
@@ -0,0 +1,13 @@
+-- scheduler daemons sharing the queue
+CREATE TABLE IF NOT EXISTS yascheduler_daemons (
+    daemon_id VARCHAR(64) PRIMARY KEY,
+    last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+-- node ownership by daemon
+CREATE TABLE IF NOT EXISTS yascheduler_node_leases (
+    ip VARCHAR(15) PRIMARY KEY REFERENCES yascheduler_nodes (ip) ON DELETE CASCADE,
+    daemon_id VARCHAR(64) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS yascheduler_node_leases_daemon_idx
+    ON yascheduler_node_leases (daemon_id);
@@ -0,0 +1,8 @@
+-- tasks with higher priority are dispatched first, then in order of submission
+ALTER TABLE yascheduler_tasks ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE yascheduler_tasks ADD COLUMN IF NOT EXISTS submitted_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE yascheduler_tasks ALTER COLUMN submitted_at SET DEFAULT NOW();
+UPDATE yascheduler_tasks SET submitted_at = NOW() WHERE status = 0 AND submitted_at IS NULL;
+DROP INDEX IF EXISTS yascheduler_tasks_to_do_idx;
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_to_do_idx
+    ON yascheduler_tasks (priority DESC, submitted_at, task_id) WHERE status = 0;
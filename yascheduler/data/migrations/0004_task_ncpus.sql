@@ -0,0 +1,2 @@
+-- number of CPUs required by the task, the whole node if NULL
+ALTER TABLE yascheduler_tasks ADD COLUMN IF NOT EXISTS ncpus SMALLINT DEFAULT NULL;
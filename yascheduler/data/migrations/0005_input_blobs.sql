@@ -0,0 +1,5 @@
+-- task input files by their SHA-256, referenced from metadata.inputs of tasks
+CREATE TABLE IF NOT EXISTS yascheduler_blobs (
+    hash CHAR(64) PRIMARY KEY,
+    content TEXT NOT NULL
+);
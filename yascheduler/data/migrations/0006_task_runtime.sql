@@ -0,0 +1,7 @@
+-- run times and arrivals of the tasks for the cloud autoscaler
+ALTER TABLE yascheduler_tasks ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE yascheduler_tasks ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP WITH TIME ZONE;
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_finished_idx
+    ON yascheduler_tasks (finished_at) WHERE finished_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS yascheduler_tasks_submitted_idx
+    ON yascheduler_tasks (submitted_at);
@@ -0,0 +1,3 @@
+-- idle time and billing periods of the nodes
+ALTER TABLE yascheduler_nodes ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE yascheduler_nodes ADD COLUMN IF NOT EXISTS last_busy_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
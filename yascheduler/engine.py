@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
+import hashlib
 from collections import UserDict
 from dataclasses import dataclass, field
+from functools import lru_cache
 from itertools import chain
-from pathlib import Path
-from typing import Callable, Dict, List, Optional, Union
+from pathlib import Path, PurePosixPath
+from shlex import quote
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from configparser import SectionProxy
 
 
@@ -30,6 +33,21 @@ Deploy = Union[
 ]
 
 
+@lru_cache(maxsize=None)
+def _file_sha256(path: Path, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    "SHA-256 of the file, computed again only when the file is changed"
+    st = path.stat()
+    return _file_sha256(path.resolve(), st.st_size, st.st_mtime_ns)
+
+
 @dataclass
 class Engine:
     name: str
@@ -116,6 +134,49 @@ class Engine:
             platform_packages=platform_packages,
         )
 
+    def get_deploy_hashes(self, local_engine_dir: Path) -> Dict[str, str]:
+        """
+        Hashes of the deployed artifacts by keys like `file:<path>`,
+        `archive:<filename>` and `url:<url>`. A remote archive is
+        identified by its url only.
+        """
+        hashes = {}
+        for deployment in self.deployable:
+            if isinstance(deployment, LocalFilesDeploy):
+                for filepath in deployment.files:
+                    hashes[f"file:{filepath}"] = file_sha256(
+                        local_engine_dir / filepath
+                    )
+            if isinstance(deployment, LocalArchiveDeploy):
+                hashes[f"archive:{deployment.filename}"] = file_sha256(
+                    local_engine_dir / deployment.filename
+                )
+            if isinstance(deployment, RemoteArchiveDeploy):
+                hashes[f"url:{deployment.url}"] = hashlib.sha256(
+                    deployment.url.encode("utf-8")
+                ).hexdigest()
+        return hashes
+
+    def get_check_condition(self) -> str:
+        """
+        Shell condition which is true when the engine is running.
+        Expects the process list in the $PS variable.
+        """
+        conditions = []
+        if self.check_pname:
+            conditions.append(
+                'printf "%s\\n" "$PS" | grep -E -q -e {}'.format(
+                    quote(self.check_pname)
+                )
+            )
+        if self.check_cmd:
+            conditions.append(
+                "{{ sh -c {} >/dev/null 2>&1; [ $? -eq {} ]; }}".format(
+                    quote(self.check_cmd), self.check_cmd_code
+                )
+            )
+        return " || ".join(conditions)
+
 
 class EngineRepository(UserDict, Dict[str, Engine]):
     def __setitem__(self, key: str, value: Engine):
@@ -145,6 +206,47 @@ class EngineRepository(UserDict, Dict[str, Engine]):
         mapped = map(lambda x: x.platform_packages, self.values())
         return list(set(chain(*mapped)))
 
+    def get_tasks_check_script(
+        self, tasks: List[Tuple[int, str, str]], pid_file: str
+    ) -> str:
+        """
+        One-line shell script checking the tasks at once by their
+        (task id, task folder, engine name).
+        Prints `<task id> <1 if running else 0>` line per task.
+        A task is checked by its process id from the `pid_file`,
+        or by its engine checks if the process id is unknown.
+        The state is `-` if there is neither the `pid_file` nor the engine
+        running, e.g. the task was never spawned.
+        """
+        # the process list is captured first, so grep doesn't match itself
+        commands = ["PS=$(ps -e -o args=)"]
+        for task_id, folder, engine_name in tasks:
+            pid_path = quote(str(PurePosixPath(folder) / pid_file))
+            engine = self.get(engine_name)
+            fallback = engine and engine.get_check_condition() or "false"
+            commands.append(
+                "if [ -f {pid} ]; then "
+                "kill -0 $(cat {pid}) 2>/dev/null && echo {id} 1 || echo {id} 0; "
+                "else {fallback} && echo {id} 1 || echo {id} -; fi".format(
+                    pid=pid_path, fallback=fallback, id=int(task_id)
+                )
+            )
+        return "; ".join(commands)
+
+    @staticmethod
+    def parse_check_output(output: str) -> Dict[int, Optional[bool]]:
+        """
+        Parse output of the script from `get_tasks_check_script`.
+        The task state is None if its process id is unknown.
+        """
+        states = {"1": True, "0": False, "-": None}
+        result = {}
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0].isdigit() and parts[1] in states:
+                result[int(parts[0])] = states[parts[1]]
+        return result
+
 
 if __name__ == "__main__":
     import pprint
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+from collections import Counter
+from configparser import ConfigParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pg8000
+
+from yascheduler import connect_db, notify_db
+from yascheduler.background_worker import BackgroundWorker
+import yascheduler.scheduler
+
+
+class NodeLimiter(object):
+    "Limits number of concurrent operations per node"
+
+    _limit: int
+    _lock: threading.Lock
+    _active: "Counter[str]"
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._active = Counter()
+
+    def try_acquire(self, ip: str) -> bool:
+        with self._lock:
+            if self._active[ip] >= self._limit:
+                return False
+            self._active[ip] += 1
+            return True
+
+    def release(self, ip: str) -> None:
+        with self._lock:
+            self._active[ip] -= 1
+            if self._active[ip] <= 0:
+                del self._active[ip]
+
+
+@dataclass
+class FetchTask:
+    task_id: int
+    ip: str
+    engine_name: str
+    remote_folder: str
+    store_folder: Path
+
+
+@dataclass
+class FetchResult:
+    task_id: int
+    store_folder: Path
+    fetched: bool = False
+
+
+class FetchWorker(BackgroundWorker):
+    _cfg: ConfigParser
+    _connection: Optional[pg8000.Connection] = None
+    _task_queue: "queue.Queue[FetchTask]"
+    _result_queue: "queue.Queue[FetchResult]"
+    _limiter: NodeLimiter
+    _sleep_interval: float = 1
+    yascheduler: "yascheduler.scheduler.Yascheduler"
+
+    def __init__(
+        self,
+        config: ConfigParser,
+        yascheduler: "yascheduler.scheduler.Yascheduler",
+        task_queue: "queue.Queue[FetchTask]",
+        result_queue: "queue.Queue[FetchResult]",
+        limiter: NodeLimiter,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self._cfg = config
+        self.yascheduler = yascheduler
+        self._task_queue = task_queue
+        self._result_queue = result_queue
+        self._limiter = limiter
+
+    def notify(self) -> None:
+        "Wake up the scheduler daemon to process the result"
+        try:
+            if not self._connection:
+                self._connection, _ = connect_db(self._cfg)
+            cursor = self._connection.cursor()
+            notify_db(cursor, "task_fetched")
+            self._connection.commit()
+        except Exception as e:
+            self._log.warning(f"Can't notify scheduler: {str(e)}")
+            self._connection = None
+
+    def do_work(self) -> None:
+        try:
+            t = self._task_queue.get(False)
+        except queue.Empty:
+            return
+
+        if not self._limiter.try_acquire(t.ip):
+            # the node is busy with other transfers, try later
+            self._task_queue.put(t)
+            self._task_queue.task_done()
+            return
+
+        r = FetchResult(task_id=t.task_id, store_folder=t.store_folder)
+        try:
+            self._log.info(f"Fetching task_id={t.task_id} from {t.ip}...")
+            self.yascheduler.ssh_get_task(
+                t.ip, t.engine_name, t.remote_folder, t.store_folder, remove=False
+            )
+            r.fetched = True
+        except Exception as e:
+            self._log.error(f"Fetching task_id={t.task_id} failed: {str(e)}")
+        finally:
+            self._limiter.release(t.ip)
+
+        # the node is released as soon as results are copied;
+        # a failed fetch is retried later, no need to wake the scheduler
+        self._result_queue.put(r)
+        if r.fetched:
+            self.notify()
+
+        if r.fetched:
+            try:
+                self.yascheduler.ssh_remove_task(t.ip, t.remote_folder)
+            except Exception as e:
+                self._log.error(f"Can't remove {t.remote_folder}: {str(e)}")
+
+        self._task_queue.task_done()
+
+    def run(self):
+        super().run()
+        if self._connection:
+            self._connection.close()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import logging
+import select
+from configparser import ConfigParser
+from datetime import datetime
+from typing import List, Optional
+
+from yascheduler import connect_db, NOTIFY_CHANNEL
+from yascheduler.time import sleep_until
+
+
+class DBListener(object):
+    """
+    Dedicated database connection subscribed to the scheduler events
+    with PostgreSQL LISTEN/NOTIFY
+    """
+
+    _log: logging.Logger
+
+    def __init__(self, config: ConfigParser, logger: Optional[logging.Logger] = None):
+        if logger:
+            self._log = logger.getChild(self.__class__.__name__)
+        else:
+            self._log = logging.getLogger(self.__class__.__name__)
+
+        self.connection, self.cursor = connect_db(config)
+        # notifications are delivered only outside of transactions
+        self.connection.autocommit = True
+        self.cursor.execute("LISTEN {};".format(NOTIFY_CHANNEL))
+
+    def _drain(self) -> List[str]:
+        events = []
+        while self.connection.notifications:
+            _, channel, payload = self.connection.notifications.popleft()
+            if channel == NOTIFY_CHANNEL:
+                events.append(payload)
+        return events
+
+    def wait_until(self, end: datetime) -> List[str]:
+        "Sleep until :end: or until any event is received"
+        events = self._drain()
+        while not events:
+            timeout = (end - datetime.now()).total_seconds()
+            if timeout <= 0:
+                break
+            sock = getattr(self.connection, "_usock", None)
+            if sock is None:
+                self._log.warning("Can't wait for events, falling back to timer")
+                sleep_until(end)
+                break
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if not readable:
+                break
+            # the driver reads pending notifications with any query response
+            self.cursor.execute("SELECT 1;")
+            events = self._drain()
+        return events
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Versioned database schema migrations.
+
+The base schema is `data/schema.sql` (version 0). Every change is a
+`data/migrations/NNNN_description.sql` file applied in order of NNNN.
+"""
+
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import pg8000
+
+MIGRATIONS_DIR = Path(__file__).parent / "data" / "migrations"
+
+
+def split_sql(sql: str) -> List[str]:
+    "Split SQL script into statements"
+    statements = []
+    for statement in sql.split(";"):
+        lines = [x for x in statement.splitlines() if not x.strip().startswith("--")]
+        statement = "\n".join(lines).strip()
+        if statement:
+            statements.append(statement)
+    return statements
+
+
+def get_migrations(path: Path = MIGRATIONS_DIR) -> List[Tuple[int, Path]]:
+    "List of (version, migration file) sorted by version"
+    migrations = []
+    for filepath in path.glob("*.sql"):
+        version, _, _ = filepath.name.partition("_")
+        if not version.isdigit():
+            continue
+        migrations.append((int(version), filepath))
+    return sorted(migrations)
+
+
+def get_latest_version(path: Path = MIGRATIONS_DIR) -> int:
+    migrations = get_migrations(path)
+    return migrations[-1][0] if migrations else 0
+
+
+def get_schema_version(cursor: pg8000.Cursor) -> int:
+    "Current schema version of the database"
+    cursor.execute("SELECT to_regclass('yascheduler_schema_version');")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute("SELECT MAX(version) FROM yascheduler_schema_version;")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(
+    connection: pg8000.Connection,
+    cursor: pg8000.Cursor,
+    log: Callable[[str], None] = print,
+    path: Path = MIGRATIONS_DIR,
+) -> int:
+    "Upgrade the database schema in place; returns the resulting version"
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS yascheduler_schema_version (
+            version INT PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        """
+    )
+    connection.commit()
+
+    version = get_schema_version(cursor)
+    for migration_version, filepath in get_migrations(path):
+        if migration_version <= version:
+            continue
+        log("Applying migration {}...".format(filepath.name))
+        # every migration is applied in its own transaction
+        for statement in split_sql(filepath.read_text()):
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO yascheduler_schema_version (version) VALUES (%s);",
+            [migration_version],
+        )
+        connection.commit()
+        version = migration_version
+    return version
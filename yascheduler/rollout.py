@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Parallel engine rollout to the nodes
+"""
+
+import io
+import json
+import logging
+import random
+import string
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from shlex import quote
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from paramiko.rsakey import RSAKey
+
+from yascheduler import ENGINE_MANIFEST_FILE
+from yascheduler.engine import (
+    Engine,
+    LocalArchiveDeploy,
+    LocalFilesDeploy,
+    RemoteArchiveDeploy,
+)
+import yascheduler.scheduler
+
+# the scheduler host as a source of the artifacts
+LOCAL = ""
+
+
+class EngineRollout(object):
+    """
+    Deploys the engine to many nodes at once. The scheduler host uploads
+    the artifacts to a few nodes only, then every node which got them sends
+    them on to another one, so the number of copies doubles with every round.
+    The nodes authenticate each other with a temporary key pair,
+    which is removed in the end.
+    """
+
+    _log: logging.Logger
+    yac: "yascheduler.scheduler.Yascheduler"
+
+    def __init__(
+        self,
+        yac: "yascheduler.scheduler.Yascheduler",
+        engine: Engine,
+        nodes: Dict[str, str],
+        threads: int = 16,
+        uplinks: int = 1,
+        progress: Optional[Callable[[str], None]] = None,
+    ):
+        self._log = yac._log.getChild(self.__class__.__name__)
+        self.yac = yac
+        self.engine = engine
+        self.nodes = nodes
+        self.threads = threads
+        self.uplinks = uplinks
+        self.progress = progress or self._log.info
+
+        self.local_engine_dir = yac.local_engines_dir / engine.name
+        self.remote_engine_dir = str(yac.remote_engines_dir / engine.name)
+        self.hashes = engine.get_deploy_hashes(self.local_engine_dir)
+
+        # files copied to the engine folder as is, archives are unpacked there
+        self.files: List[str] = []
+        self.archives: List[str] = []
+        for deployment in engine.deployable:
+            if isinstance(deployment, LocalFilesDeploy):
+                self.files.extend(str(x) for x in deployment.files)
+            if isinstance(deployment, LocalArchiveDeploy):
+                self.archives.append(str(deployment.filename))
+
+        self.marker = "yascheduler-rollout-" + "".join(
+            random.choice(string.ascii_lowercase) for _ in range(8)
+        )
+        self.key_file = "." + self.marker
+        self._key = RSAKey.generate(2048)
+
+    def _exec(self, ip: str, script: str, data: bytes = b"") -> str:
+        with self.yac.ssh_pool.connection(ip, self.nodes[ip]) as machine:
+            retcode, stdout, stderr = machine.exec_with_input(
+                "sh -c {}".format(quote(script)), data
+            )
+        if retcode != 0:
+            raise RuntimeError(stderr.strip() or f"exit code {retcode}")
+        return stdout
+
+    def _is_deployed(self, ip: str) -> bool:
+        output = self._exec(
+            ip,
+            "cat {} 2>/dev/null || true".format(
+                quote(f"{self.remote_engine_dir}/{ENGINE_MANIFEST_FILE}")
+            ),
+        )
+        try:
+            manifest = json.loads(output)
+        except ValueError:
+            return False
+        return all(manifest.get(k) == v for k, v in self.hashes.items())
+
+    def _prepare(self, ip: str) -> None:
+        "Let the other nodes in and out with the temporary key"
+        private_key = io.StringIO()
+        self._key.write_private_key(private_key)
+        public_key = f"{self._key.get_name()} {self._key.get_base64()} {self.marker}"
+        self._exec(
+            ip,
+            "mkdir -p {dir} ~/.ssh && chmod 700 ~/.ssh && "
+            "echo {pub} >> ~/.ssh/authorized_keys && "
+            "(umask 077 && cat > {key})".format(
+                dir=quote(self.remote_engine_dir),
+                pub=quote(public_key),
+                key=quote(self.key_file),
+            ),
+            private_key.getvalue().encode("utf-8"),
+        )
+
+    def _upload(self, ip: str) -> None:
+        with self.yac.ssh_pool.connection(ip, self.nodes[ip]) as machine:
+            remote_engine_dir = machine.path(self.remote_engine_dir)
+            for filename in self.files + self.archives:
+                machine.upload(
+                    self.local_engine_dir / filename, remote_engine_dir.join(filename)
+                )
+
+    def _relay(self, src: str, dst: str) -> None:
+        "Copy the artifacts from one node to another"
+        self._exec(
+            src,
+            "cd {dir} && scp -q -i ~/{key} -o BatchMode=yes "
+            "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null "
+            "{files} {dst}:{dir}/".format(
+                dir=quote(self.remote_engine_dir),
+                key=quote(self.key_file),
+                files=" ".join(quote(x) for x in self.files + self.archives),
+                dst=quote(f"{self.nodes[dst]}@{dst}"),
+            ),
+        )
+
+    def _finalize(self, ip: str) -> None:
+        "Unpack the artifacts and save the manifest"
+        commands = ["mkdir -p {0} && cd {0}".format(quote(self.remote_engine_dir))]
+        for filename in self.files:
+            commands.append("chmod +x {}".format(quote(filename)))
+        # the archives are kept to be relayed until cleanup
+        for filename in self.archives:
+            commands.append("tar xf {}".format(quote(filename)))
+        for deployment in self.engine.deployable:
+            if isinstance(deployment, RemoteArchiveDeploy):
+                commands.append(
+                    "wget -q {} -O archive.tar.gz && tar xf archive.tar.gz && "
+                    "rm archive.tar.gz".format(quote(deployment.url))
+                )
+        commands.append("cat > {}".format(ENGINE_MANIFEST_FILE))
+        self._exec(
+            ip, " && ".join(commands), json.dumps(self.hashes, indent=2).encode()
+        )
+
+    def _cleanup(self, ip: str) -> None:
+        self._exec(
+            ip,
+            "rm -f ~/{key} {archives}; "
+            "sed -i {pattern} ~/.ssh/authorized_keys".format(
+                key=quote(self.key_file),
+                archives=" ".join(
+                    quote(f"{self.remote_engine_dir}/{x}") for x in self.archives
+                ),
+                pattern=quote(f"/{self.marker}/d"),
+            ),
+        )
+
+    def _map(
+        self, executor: ThreadPoolExecutor, fn: Callable[[str], object], ips: List[str]
+    ) -> Dict[str, Optional[Exception]]:
+        "Run :fn: for every node; errors by node"
+        futures = {ip: executor.submit(fn, ip) for ip in ips}
+        return {ip: future.exception() for ip, future in futures.items()}
+
+    def _deploy(self, src: str, dst: str) -> None:
+        if src == LOCAL:
+            self._upload(dst)
+        else:
+            self._relay(src, dst)
+        self._finalize(dst)
+
+    def run(self) -> Dict[str, Optional[str]]:
+        "Deploy to all the nodes; errors by node"
+        errors: Dict[str, Optional[str]] = {}
+
+        def fail(ip: str, err: Exception) -> None:
+            errors[ip] = str(err)
+            self.progress(f"{ip}: failed: {err}")
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            seeds, targets = [], []
+            checks = {ip: executor.submit(self._is_deployed, ip) for ip in self.nodes}
+            for ip, future in checks.items():
+                try:
+                    if future.result():
+                        seeds.append(ip)
+                        errors[ip] = None
+                    else:
+                        targets.append(ip)
+                except Exception as err:
+                    fail(ip, err)
+            self.progress(
+                f"{len(seeds)} nodes are up to date, {len(targets)} to deploy"
+            )
+            if not targets:
+                return errors
+
+            prepared = seeds + targets if self.files or self.archives else []
+            try:
+                for ip, err in self._map(executor, self._prepare, prepared).items():
+                    if err and ip in seeds:
+                        self._log.warning(f"{ip}: can't relay: {err}")
+                        seeds.remove(ip)
+                    elif err:
+                        fail(ip, err)
+                targets = [x for x in targets if x not in errors]
+                # archives are removed from the nodes set up earlier
+                sources: Deque[str] = deque([LOCAL] * self.uplinks)
+                if not self.archives:
+                    sources.extend(seeds)
+                if not self.files and not self.archives:
+                    # nothing to copy, every node only downloads its archive
+                    sources = deque([LOCAL] * len(targets))
+
+                pending: Deque[str] = deque(targets)
+                # failed to get from another node, retried from the scheduler host
+                pending_local: Deque[str] = deque()
+                running: Dict[Future, Tuple[str, str]] = {}
+                n_done = 0
+                while pending or pending_local or running:
+                    while len(running) < self.threads:
+                        if pending_local and LOCAL in sources:
+                            sources.remove(LOCAL)
+                            src, dst = LOCAL, pending_local.popleft()
+                        elif pending and sources:
+                            src, dst = sources.popleft(), pending.popleft()
+                        else:
+                            break
+                        running[executor.submit(self._deploy, src, dst)] = (src, dst)
+                    if not running:
+                        for dst in list(pending_local) + list(pending):
+                            fail(dst, RuntimeError("no source left"))
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        src, dst = running.pop(future)
+                        sources.append(src)
+                        err = future.exception()
+                        if err is None:
+                            n_done += 1
+                            errors[dst] = None
+                            sources.append(dst)
+                            self.progress(
+                                f"[{n_done}/{len(targets)}] {dst}: "
+                                f"deployed from {src or 'scheduler'}"
+                            )
+                        elif src != LOCAL:
+                            self._log.warning(f"{dst}: can't get from {src}: {err}")
+                            pending_local.append(dst)
+                        else:
+                            fail(dst, err)
+            finally:
+                # the keys and archives are removed even if interrupted
+                for ip, err in self._map(executor, self._cleanup, prepared).items():
+                    if err:
+                        self._log.warning(f"{ip}: cleanup failed: {err}")
+
+        return errors
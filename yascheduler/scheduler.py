@@ -1,22 +1,50 @@
 #!/usr/bin/env python
 
+import asyncio
+import hashlib
+import io
 import json
 import logging
+import math
 import os
 import queue
 import random
+import shutil
+import socket
 import string
+import sys
+import tarfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from configparser import ConfigParser
 from datetime import datetime, timedelta
 from collections import Counter
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from pathlib import Path, PurePosixPath
+from shlex import quote
+from typing import Any, ContextManager, Dict, List, Optional, Set, Tuple
 
 import pg8000
-from plumbum.commands.processes import CommandNotFound, ProcessExecutionError
-
-from yascheduler import connect_db, CONFIG_FILE, SLEEP_INTERVAL, N_IDLE_PASSES
+from plumbum.commands.processes import CommandNotFound
+
+from yascheduler import (
+    connect_db,
+    notify_db,
+    CHUNKED_DOWNLOAD_THRESHOLD,
+    CONFIG_FILE,
+    ENGINE_MANIFEST_FILE,
+    FETCH_RETRY_DELAY,
+    FETCH_RETRY_MAX_DELAY,
+    FETCH_TIMEOUT,
+    NODE_IMAGE_FILE,
+    SLEEP_INTERVAL,
+    NODE_LEASE_TTL,
+    NODE_NCPUS_RETRY_DELAY,
+    SUBMIT_BATCH_SIZE,
+    TASK_PID_FILE,
+)
 import yascheduler.clouds
+from yascheduler.async_ssh import AsyncSSH
+from yascheduler.background_worker import BackgroundWorker
 from yascheduler.engine import (
     Engine,
     EngineRepository,
@@ -24,8 +52,10 @@ from yascheduler.engine import (
     LocalArchiveDeploy,
     RemoteArchiveDeploy,
 )
-from yascheduler.ssh import MyParamikoMachine
-from yascheduler.time import sleep_until
+from yascheduler.fetch_worker import FetchResult, FetchTask, FetchWorker, NodeLimiter
+from yascheduler.listener import DBListener
+from yascheduler.migrations import get_latest_version, get_schema_version
+from yascheduler.ssh import MyParamikoMachine, SSHPool
 from yascheduler.webhook_worker import WebhookWorker, WebhookTask
 
 logging.basicConfig(level=logging.INFO)
@@ -36,13 +66,24 @@ class Yascheduler:
     STATUS_TO_DO = 0
     STATUS_RUNNING = 1
     STATUS_DONE = 2
+    STATUS_FETCHING = 3
 
     _log: logging.Logger
+    _fetch_queue: "queue.Queue[FetchTask]"
+    _fetch_results: "queue.Queue[FetchResult]"
+    _fetch_threads: List[FetchWorker]
+    _fetching: Set[int]
+    _fetch_retries: Dict[int, Tuple[int, float]]
+    _busy_check_pool: ThreadPoolExecutor
+    _busy_checks: Dict[str, Future]
+    _ncpus_checks: Dict[str, Future]
+    _ncpus_retry_at: Dict[str, float]
     _webhook_queue: "queue.Queue[WebhookTask]"
     _webhook_threads: List[WebhookWorker]
     clouds: Optional["yascheduler.clouds.CloudAPIManager"] = None
     connection: pg8000.Connection
     cursor: pg8000.Cursor
+    daemon_id: str
     engines: EngineRepository
     local_engines_dir: Path
     local_data_dir: Path
@@ -51,7 +92,11 @@ class Yascheduler:
     remote_engines_dir: Path
     remote_data_dir: Path
     remote_tasks_dir: Path
-    remote_machines: Dict[str, MyParamikoMachine]
+    busy_check_timeout: float
+    node_lease_ttl: int
+    remote_users: Dict[str, str]
+    ssh_pool: SSHPool
+    async_ssh: Optional[AsyncSSH]
     ssh_user: str
 
     def __init__(self, config: ConfigParser, logger: Optional[logging.Logger] = None):
@@ -82,7 +127,31 @@ class Yascheduler:
         )
 
         self.connection, self.cursor = connect_db(config)
-        self.remote_machines = {}
+        self.daemon_id = "{}-{}".format(socket.gethostname(), os.getpid())[-64:]
+        self.node_lease_ttl = int(local_cfg.get("node_lease_ttl", NODE_LEASE_TTL))
+        self.remote_users = {}
+        self.ssh_pool = SSHPool(
+            keys_dir=self.local_keys_dir,
+            keepalive_interval=int(remote_cfg.get("keepalive_interval", "30")),
+            max_channels=int(remote_cfg.get("max_channels", "8")),
+            logger=self._log,
+        )
+        # the paramiko connections are used for node setup anyway
+        ssh_backend = remote_cfg.get("ssh_backend", "paramiko")
+        assert ssh_backend in (
+            "paramiko",
+            "asyncssh",
+        ), f"Unsupported ssh_backend: {ssh_backend}"
+        self.async_ssh = None
+        if ssh_backend == "asyncssh":
+            self.async_ssh = AsyncSSH(
+                keys_dir=self.local_keys_dir,
+                keepalive_interval=int(remote_cfg.get("keepalive_interval", "30")),
+                max_channels=int(remote_cfg.get("max_channels", "8")),
+                logger=self._log,
+            )
+        self._ncpus_checks = {}
+        self._ncpus_retry_at = {}
         self.ssh_user = remote_cfg.get("user", fallback="root")
         self.engines = self._load_engines(config)
 
@@ -97,6 +166,39 @@ class Yascheduler:
             )
             self._webhook_threads.append(t)
 
+        self._fetch_queue = queue.Queue()
+        self._fetch_results = queue.Queue()
+        self._fetching = set()
+        # failed attempts and the time of the next one by task
+        self._fetch_retries = {}
+        fetch_thread_num = int(local_cfg.get("fetch_threads", "4"))
+        limiter = NodeLimiter(int(local_cfg.get("fetch_threads_per_node", "1")))
+        self.fetch_compression = local_cfg.get("fetch_compression", "gzip")
+        self.fetch_timeout = int(local_cfg.get("fetch_timeout", FETCH_TIMEOUT))
+        assert self.fetch_compression in (
+            "gzip",
+            "none",
+        ), f"Unsupported fetch_compression: {self.fetch_compression}"
+        self._fetch_threads = []
+        for i in range(fetch_thread_num):
+            t = FetchWorker(
+                name=f"FetchThread[{i}]",
+                logger=self._log,
+                config=config,
+                yascheduler=self,
+                task_queue=self._fetch_queue,
+                result_queue=self._fetch_results,
+                limiter=limiter,
+            )
+            self._fetch_threads.append(t)
+
+        self._busy_check_pool = ThreadPoolExecutor(
+            max_workers=int(local_cfg.get("busy_check_threads", "32")),
+            thread_name_prefix="BusyCheckThread",
+        )
+        self._busy_checks = {}
+        self.busy_check_timeout = float(local_cfg.get("busy_check_timeout", "30"))
+
     def _load_engines(self, cfg: ConfigParser) -> EngineRepository:
         engines = EngineRepository()
         for section_name in cfg.sections():
@@ -114,6 +216,8 @@ class Yascheduler:
     def start(self) -> None:
         for t in self._webhook_threads:
             t.start()
+        for t in self._fetch_threads:
+            t.start()
 
     def queue_get_resources(self):
         self.cursor.execute("SELECT ip, ncpus, enabled, cloud FROM yascheduler_nodes;")
@@ -155,7 +259,8 @@ class Yascheduler:
             """
             SELECT task_id, label, metadata
             FROM yascheduler_tasks
-            WHERE status=%s LIMIT %s;
+            WHERE status=%s
+            ORDER BY priority DESC, submitted_at, task_id LIMIT %s;
             """,
             (self.STATUS_TO_DO, num_nodes),
         )
@@ -164,6 +269,95 @@ class Yascheduler:
             for row in self.cursor.fetchall()
         ]
 
+    def queue_claim_tasks_to_do(
+        self, free_cpus: Dict[str, int], node_ncpus: Dict[str, int]
+    ) -> List[Dict[str, Any]]:
+        """
+        Atomically mark tasks to do as running on the nodes with enough
+        free CPUs, packing the fullest nodes first. A task without ncpus
+        requires the whole idle node. Tasks being claimed by other daemons
+        are skipped, as well as the nodes whose leases are lost.
+        The least loaded node is reserved for the first task that doesn't fit,
+        so the smaller tasks after it can't starve it.
+        The `free_cpus` is updated in place.
+        """
+        if not any(free_cpus.values()):
+            return []
+        # the leases are locked, so the nodes can't be taken over meanwhile
+        self.cursor.execute(
+            """
+            SELECT ip FROM yascheduler_node_leases
+            WHERE daemon_id=%s AND expires_at > NOW() AND ip = ANY(%s)
+            FOR UPDATE;
+            """,
+            (self.daemon_id, list(free_cpus)),
+        )
+        owned = set(row[0] for row in self.cursor.fetchall())
+        # every task takes at least one CPU
+        self.cursor.execute(
+            """
+            SELECT task_id, label, metadata, ncpus
+            FROM yascheduler_tasks
+            WHERE status=%s
+            ORDER BY priority DESC, submitted_at, task_id LIMIT %s
+            FOR UPDATE SKIP LOCKED;
+            """,
+            (self.STATUS_TO_DO, sum(free_cpus.values())),
+        )
+        tasks = []
+        reserved: Optional[str] = None
+        for task_id, label, metadata, ncpus in self.cursor.fetchall():
+            nodes = [ip for ip in free_cpus if ip in owned and ip != reserved]
+            if ncpus:
+                fits = [ip for ip in nodes if free_cpus[ip] >= ncpus]
+            else:
+                fits = [ip for ip in nodes if free_cpus[ip] == node_ncpus[ip] > 0]
+            if not fits:
+                # the node is left to drain until the task fits
+                larger = [ip for ip in nodes if node_ncpus[ip] >= (ncpus or 0)]
+                if reserved is None and larger:
+                    reserved = max(larger, key=lambda x: free_cpus[x])
+                continue
+            ip = min(fits, key=lambda x: free_cpus[x])
+            ncpus = ncpus or node_ncpus[ip]
+            free_cpus[ip] -= ncpus
+            self.cursor.execute(
+                "UPDATE yascheduler_tasks SET status=%s, ip=%s WHERE task_id=%s;",
+                (self.STATUS_RUNNING, ip, task_id),
+            )
+            tasks.append(
+                dict(
+                    task_id=task_id, label=label, metadata=metadata, ip=ip, ncpus=ncpus
+                )
+            )
+        self.connection.commit()
+        return tasks
+
+    def queue_get_running_tasks(self, ips: List[str]) -> List[Dict[str, Any]]:
+        "Running and fetching tasks on the given nodes"
+        self.cursor.execute(
+            """
+            SELECT task_id, label, ip, status, ncpus,
+                metadata->>'remote_folder', metadata->>'engine', started_at
+            FROM yascheduler_tasks
+            WHERE status IN (%s, %s) AND ip = ANY(%s);
+            """,
+            (self.STATUS_RUNNING, self.STATUS_FETCHING, ips),
+        )
+        return [
+            dict(
+                task_id=row[0],
+                label=row[1],
+                ip=row[2],
+                status=row[3],
+                ncpus=row[4],
+                remote_folder=row[5],
+                engine=row[6],
+                started_at=row[7],
+            )
+            for row in self.cursor.fetchall()
+        ]
+
     def queue_get_tasks(self, jobs=None, status=None):
         if jobs is not None and status is not None:
             raise ValueError("jobs can be selected only by status or by task ids")
@@ -187,6 +381,108 @@ class Yascheduler:
             for row in self.cursor.fetchall()
         ]
 
+    def queue_count_by_status(self) -> Dict[int, int]:
+        "Number of tasks by status"
+        self.cursor.execute(
+            "SELECT status, COUNT(*) FROM yascheduler_tasks GROUP BY status;"
+        )
+        counts = {
+            status: 0
+            for status in (
+                self.STATUS_TO_DO,
+                self.STATUS_RUNNING,
+                self.STATUS_FETCHING,
+                self.STATUS_DONE,
+            )
+        }
+        counts.update({row[0]: row[1] for row in self.cursor.fetchall()})
+        return counts
+
+    def queue_acquire_nodes(self, ips: List[str]) -> Tuple[List[str], int]:
+        """
+        Renew leases of own nodes and take over unowned ones up to a fair
+        share among the alive daemons. Returns owned nodes and the share.
+        """
+        c = self.cursor
+        c.execute(
+            """
+            INSERT INTO yascheduler_daemons (daemon_id, last_seen)
+            VALUES (%s, NOW())
+            ON CONFLICT (daemon_id) DO UPDATE SET last_seen=NOW();
+            """,
+            [self.daemon_id],
+        )
+        c.execute(
+            """
+            DELETE FROM yascheduler_daemons
+            WHERE last_seen < NOW() - %s * INTERVAL '1 second';
+            """,
+            [self.node_lease_ttl],
+        )
+        c.execute("SELECT COUNT(*) FROM yascheduler_daemons;")
+        share = math.ceil(len(ips) / max(1, c.fetchone()[0]))
+
+        c.execute(
+            """
+            UPDATE yascheduler_node_leases
+            SET expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE daemon_id=%s RETURNING ip;
+            """,
+            [self.node_lease_ttl, self.daemon_id],
+        )
+        owned = [row[0] for row in c.fetchall() if row[0] in ips]
+
+        if len(owned) < share:
+            c.execute(
+                """
+                INSERT INTO yascheduler_node_leases (ip, daemon_id, expires_at)
+                SELECT n.ip, %s, NOW() + %s * INTERVAL '1 second'
+                FROM yascheduler_nodes AS n
+                LEFT JOIN yascheduler_node_leases AS l ON l.ip=n.ip
+                WHERE n.ip = ANY(%s) AND (l.ip IS NULL OR l.expires_at < NOW())
+                ORDER BY RANDOM() LIMIT %s
+                ON CONFLICT (ip) DO UPDATE
+                SET daemon_id=EXCLUDED.daemon_id, expires_at=EXCLUDED.expires_at
+                WHERE yascheduler_node_leases.expires_at < NOW()
+                RETURNING ip;
+                """,
+                [self.daemon_id, self.node_lease_ttl, ips, share - len(owned)],
+            )
+            owned.extend([row[0] for row in c.fetchall()])
+        self.connection.commit()
+        return owned, share
+
+    def queue_release_nodes(self, ips: Optional[List[str]] = None) -> None:
+        "Release own nodes, all by default"
+        if ips is None:
+            self.cursor.execute(
+                "DELETE FROM yascheduler_daemons WHERE daemon_id=%s;",
+                [self.daemon_id],
+            )
+            self.cursor.execute(
+                "DELETE FROM yascheduler_node_leases WHERE daemon_id=%s;",
+                [self.daemon_id],
+            )
+        else:
+            self.cursor.execute(
+                """
+                DELETE FROM yascheduler_node_leases
+                WHERE daemon_id=%s AND ip = ANY(%s);
+                """,
+                [self.daemon_id, ips],
+            )
+        self.connection.commit()
+
+    def queue_set_nodes_busy(self, ips: List[str]) -> None:
+        "Nodes are idle from the last time they were busy"
+        if not ips:
+            return
+        self.cursor.execute(
+            "UPDATE yascheduler_nodes SET last_busy_at=NOW() WHERE ip = ANY(%s);",
+            [ips],
+        )
+        self.connection.commit()
+
     def enqueue_task_event(self, task_id: int) -> None:
         task = self.queue_get_task(task_id) or {}
         wt = WebhookTask.from_dict(task)
@@ -194,12 +490,45 @@ class Yascheduler:
 
     def queue_set_task_running(self, task_id, ip):
         self.cursor.execute(
-            "UPDATE yascheduler_tasks SET status=%s, ip=%s WHERE task_id=%s;",
+            """
+            UPDATE yascheduler_tasks SET status=%s, ip=%s, started_at=NOW()
+            WHERE task_id=%s;
+            """,
             (self.STATUS_RUNNING, ip, task_id),
         )
         self.connection.commit()
         self.enqueue_task_event(task_id)
 
+    def queue_set_task_to_do(self, task_id):
+        "Return claimed task to the queue"
+        self.cursor.execute(
+            "UPDATE yascheduler_tasks SET status=%s, ip=NULL WHERE task_id=%s;",
+            (self.STATUS_TO_DO, task_id),
+        )
+        self.connection.commit()
+
+    def queue_set_task_fetching(self, task_id):
+        self.cursor.execute(
+            """
+            UPDATE yascheduler_tasks SET status=%s, finished_at=NOW()
+            WHERE task_id=%s;
+            """,
+            (self.STATUS_FETCHING, task_id),
+        )
+        self.connection.commit()
+
+    def queue_is_fetch_timed_out(self, task_id: int) -> bool:
+        "The task is fetching its results longer than allowed"
+        self.cursor.execute(
+            """
+            SELECT finished_at < NOW() - %s * INTERVAL '1 second'
+            FROM yascheduler_tasks WHERE task_id=%s AND status=%s;
+            """,
+            (self.fetch_timeout, task_id, self.STATUS_FETCHING),
+        )
+        row = self.cursor.fetchone()
+        return bool(row and row[0])
+
     def queue_set_task_done(self, task_id, metadata):
         self.cursor.execute(
             """
@@ -211,40 +540,137 @@ class Yascheduler:
         )
         self.connection.commit()
         self.enqueue_task_event(task_id)
-        # if self.clouds:
-        # TODO: free-up CloudAPIManager().tasks
-
-    def queue_submit_task(self, label: str, metadata: Dict[str, Any], engine_name: str):
-        if engine_name not in self.engines:
-            raise RuntimeError("Engine %s requested, but not supported" % engine_name)
 
-        for input_file in self.engines[engine_name].input_files:
-            if input_file not in metadata:
-                raise RuntimeError("Input file %s was not provided" % input_file)
-
-        metadata["engine"] = engine_name
-        rnd_str = "".join([random.choice(string.ascii_lowercase) for _ in range(4)])
-        metadata["remote_folder"] = str(
-            self.remote_tasks_dir
-            / "{}_{}".format(datetime.now().strftime("%Y%m%d_%H%M%S"), rnd_str)
+    def queue_submit_task(
+        self,
+        label: str,
+        metadata: Dict[str, Any],
+        engine_name: str,
+        priority: int = 0,
+        ncpus: Optional[int] = None,
+    ):
+        """
+        Submit a task; tasks with higher priority are dispatched first.
+        The task requiring `ncpus` may share a node with other tasks,
+        otherwise it takes the whole node.
+        """
+        task = dict(
+            label=label,
+            metadata=metadata,
+            engine=engine_name,
+            priority=priority,
+            ncpus=ncpus,
         )
+        return self.queue_submit_tasks([task])[0]
+
+    def queue_submit_tasks(self, tasks: List[Dict[str, Any]]) -> List[int]:
+        """
+        Submit tasks in a single transaction. Every task is a dict of
+        `label`, `metadata`, `engine` and optional `priority` and `ncpus`,
+        as arguments of `queue_submit_task`. Returns task ids in order.
+        """
+        for task in tasks:
+            engine_name = task["engine"]
+            if engine_name not in self.engines:
+                raise RuntimeError(
+                    "Engine %s requested, but not supported" % engine_name
+                )
+            for input_file in self.engines[engine_name].input_files:
+                if input_file not in task["metadata"]:
+                    raise RuntimeError("Input file %s was not provided" % input_file)
+        if not tasks:
+            return []
 
+        # task ids are taken in advance to keep the order
         self.cursor.execute(
-            """
-            INSERT INTO yascheduler_tasks (label, metadata, ip, status)
-            VALUES ('{label}', '{metadata}', NULL, {status})
-            RETURNING task_id;""".format(
-                label=label,
-                metadata=json.dumps(metadata).replace("'", "''"),
-                status=self.STATUS_TO_DO,
-            )
+            "SELECT nextval('task_id_seq') FROM generate_series(1, %s);",
+            [len(tasks)],
         )
+        task_ids = sorted([row[0] for row in self.cursor.fetchall()])
+
+        rows = []
+        blobs: Dict[str, str] = {}
+        submitted_at = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for task_id, task in zip(task_ids, tasks):
+            metadata = dict(task["metadata"])
+            metadata["engine"] = task["engine"]
+            # input files are stored once, the task refers them by hash
+            inputs = {}
+            for input_file in self.engines[task["engine"]].input_files:
+                content = metadata.pop(input_file)
+                digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+                blobs[digest] = content
+                inputs[input_file] = digest
+            metadata["inputs"] = inputs
+            rnd_str = "".join([random.choice(string.ascii_lowercase) for _ in range(4)])
+            metadata["remote_folder"] = str(
+                self.remote_tasks_dir
+                / "{}_{}_{}".format(submitted_at, rnd_str, task_id)
+            )
+            ncpus = task.get("ncpus")
+            rows.append(
+                (
+                    task_id,
+                    task["label"],
+                    json.dumps(metadata),
+                    self.STATUS_TO_DO,
+                    int(task.get("priority") or 0),
+                    int(ncpus) if ncpus else None,
+                )
+            )
+
+        # multi-row inserts, the statement size is limited
+        blob_rows = list(blobs.items())
+        for i in range(0, len(blob_rows), SUBMIT_BATCH_SIZE):
+            chunk = blob_rows[i : i + SUBMIT_BATCH_SIZE]
+            values = ", ".join(["(%s, %s)"] * len(chunk))
+            self.cursor.execute(
+                """
+                INSERT INTO yascheduler_blobs (hash, content)
+                VALUES {}
+                ON CONFLICT (hash) DO NOTHING;
+                """.format(
+                    values
+                ),
+                [param for row in chunk for param in row],
+            )
+        for i in range(0, len(rows), SUBMIT_BATCH_SIZE):
+            chunk = rows[i : i + SUBMIT_BATCH_SIZE]
+            values = ", ".join(["(%s, %s, %s, NULL, %s, %s, %s)"] * len(chunk))
+            self.cursor.execute(
+                """
+                INSERT INTO yascheduler_tasks
+                (task_id, label, metadata, ip, status, priority, ncpus)
+                VALUES {};
+                """.format(
+                    values
+                ),
+                [param for row in chunk for param in row],
+            )
+        notify_db(self.cursor, "task_submitted")
         self.connection.commit()
-        self._log.info(":::submitted: %s" % label)
-        return self.cursor.fetchone()[0]
+        if len(tasks) == 1:
+            self._log.info(":::submitted: %s" % tasks[0]["label"])
+        else:
+            self._log.info(":::submitted: %s tasks" % len(tasks))
+        return task_ids
+
+    def queue_get_task_inputs(self, metadata: Dict[str, Any]) -> Dict[str, str]:
+        "Contents of the task input files"
+        engine = self.engines[metadata["engine"]]
+        refs: Dict[str, str] = metadata.get("inputs")
+        if refs is None:
+            # submitted before the inputs were moved out of the task
+            return {x: metadata[x] for x in engine.input_files}
+        self.cursor.execute(
+            "SELECT hash, content FROM yascheduler_blobs WHERE hash = ANY(%s);",
+            [list(set(refs.values()))],
+        )
+        blobs = dict(self.cursor.fetchall())
+        return {name: blobs[digest] for name, digest in refs.items()}
 
     def ssh_connect(self, new_nodes):
-        old_nodes = self.remote_machines.keys()
+        old_nodes = self.remote_users.keys()
 
         ip_cloud_map = {}
         resources = self.queue_get_resources()
@@ -253,51 +679,112 @@ class Yascheduler:
                 ip_cloud_map[row[0]] = row[3]
 
         for ip in set(old_nodes) - set(new_nodes):
-            self.remote_machines[ip].close()
-            del self.remote_machines[ip]
+            self.ssh_pool.close(ip)
+            if self.async_ssh:
+                self.async_ssh.close(ip)
+            del self.remote_users[ip]
+            self._ncpus_checks.pop(ip, None)
+            self._ncpus_retry_at.pop(ip, None)
         for ip in set(new_nodes) - set(old_nodes):
             cloud = self.clouds and self.clouds.apis.get(ip_cloud_map.get(ip))
-            ssh_user = cloud and cloud.ssh_user or self.ssh_user
-            self.remote_machines[ip] = MyParamikoMachine.create_machine(
-                host=ip,
-                user=ssh_user,
-                keys_dir=self.local_keys_dir,
-            )
+            # the connection is opened on the first use
+            self.remote_users[ip] = cloud and cloud.ssh_user or self.ssh_user
 
-        self._log.info("Nodes to watch: %s" % ", ".join(self.remote_machines.keys()))
-        if not self.remote_machines:
+        self._log.info("Nodes to watch: %s" % ", ".join(self.remote_users.keys()))
+        if not self.remote_users:
             self._log.warning("No nodes set!")
         return True
 
-    def ssh_run_task(self, ip, ncpus, label, metadata):
-        # TODO handle this situation
-        assert not self.ssh_node_busy_check(
-            ip
-        ), f"""
-            Cannot run the task {label} at host {ip}, as this host is already
-            occupied with another task!
-            """
+    def ssh_node(self, ip: str) -> ContextManager[MyParamikoMachine]:
+        "Pooled connection to the watched node"
+        return self.ssh_pool.connection(ip, self.remote_users[ip])
+
+    def ssh_exec(
+        self, ip: str, cmd: str, data: Optional[bytes] = None
+    ) -> Tuple[int, str, str]:
+        "Run the command on the watched node, feeding :data: to its stdin"
+        if self.async_ssh:
+            return self.async_ssh.call(
+                self.async_ssh.run(ip, self.remote_users[ip], cmd, data)
+            )
+        with self.ssh_node(ip) as machine:
+            return machine.exec_with_input(cmd, data or b"")
+
+    def ssh_abspath(self, ip: str, path) -> PurePosixPath:
+        "Path on the node; relative ones start from the remote working directory"
+        if self.async_ssh:
+            cwd = self.async_ssh.call(self.async_ssh.home(ip, self.remote_users[ip]))
+        else:
+            with self.ssh_node(ip) as machine:
+                cwd = str(machine.cwd)
+        return PurePosixPath(cwd, path)
+
+    def _detect_ncpus(self, ip: str) -> int:
+        _, output, _ = self.ssh_exec(ip, "nproc --all")
+        return int(output.strip())
+
+    def ssh_get_ncpus(self, ip: str, ncpus: Optional[int] = None) -> Optional[int]:
+        """
+        Number of node CPUs. If not set, it is detected in the background
+        and saved to the database, so None is returned meanwhile.
+        A failed detection is retried after a delay.
+        """
+        if ncpus:
+            return ncpus
+        future = self._ncpus_checks.get(ip)
+        if future is None:
+            if time.monotonic() >= self._ncpus_retry_at.get(ip, 0):
+                self._ncpus_checks[ip] = self._busy_check_pool.submit(
+                    self._detect_ncpus, ip
+                )
+            return None
+        if not future.done():
+            return None
+        del self._ncpus_checks[ip]
+        try:
+            ncpus = future.result()
+        except Exception as err:
+            self._log.error(f"Can't detect CPUs count of {ip}: {err}")
+            self._ncpus_retry_at[ip] = time.monotonic() + NODE_NCPUS_RETRY_DELAY
+            return None
+        self._ncpus_retry_at.pop(ip, None)
+        self.cursor.execute(
+            "UPDATE yascheduler_nodes SET ncpus=%s WHERE ip=%s AND ncpus IS NULL;",
+            [ncpus, ip],
+        )
+        self.connection.commit()
+        return ncpus
+
+    @staticmethod
+    def _pack_inputs(inputs: Dict[str, str]) -> bytes:
+        "Gzipped tar of the task input files"
+        buf = io.BytesIO()
+        mtime = time.time()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            for name, content in inputs.items():
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = mtime
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
 
+    def ssh_run_task(self, ip, ncpus, label, metadata):
         assert metadata["remote_folder"]
         engine = self.engines.get(metadata["engine"])
         assert engine
 
-        machine = self.remote_machines[ip]
-        task_dir = machine.path(metadata["remote_folder"])
         try:
-            if not task_dir.exists():
-                task_dir.mkdir(parents=True)
-            for input_file in engine.input_files:
-                r_input_file = task_dir.join(input_file)
-                r_input_file.write(metadata[input_file], encoding="utf-8")
+            inputs = self.queue_get_task_inputs(metadata)
 
-            # detect cpus
+            # the node detects cpus itself
             if not ncpus:
-                ncpus = machine.cmd.nproc("--all").strip()
+                ncpus = "$(nproc --all)"
 
             # resolve paths
-            engine_path = machine.path(self.remote_engines_dir / engine.name)
-            task_path = machine.path(metadata["remote_folder"])
+            engine_path = self.ssh_abspath(ip, self.remote_engines_dir / engine.name)
+            task_path = self.ssh_abspath(ip, metadata["remote_folder"])
 
             # placeholders {task_path}, {engine_path} and {ncpus} are supported
             run_cmd = engine.spawn.format(
@@ -307,69 +794,345 @@ class Yascheduler:
             )
             self._log.debug(run_cmd)
 
-            r_nohup = machine.cmd.nohup
-            r_sh = machine.cmd.sh
-            r_nohup[r_sh, "-c", run_cmd].with_cwd(task_dir).run_bg()
+            # the inputs are unpacked and the task is launched in one exec;
+            # the process id is saved before returning to track the task
+            script = (
+                "mkdir -p {dir} && cd {dir} && tar xzf - && "
+                "{{ nohup sh -c {cmd} </dev/null >/dev/null 2>&1 & echo $! > {pid}; }}"
+            ).format(dir=quote(str(task_path)), cmd=quote(run_cmd), pid=TASK_PID_FILE)
+            retcode, _, stderr = self.ssh_exec(
+                ip, "sh -c {}".format(quote(script)), self._pack_inputs(inputs)
+            )
+            if retcode != 0:
+                raise RuntimeError(stderr.strip() or f"exit code {retcode}")
         except Exception as err:
             self._log.error("SSH spawn cmd error: %s" % err)
             return False
 
         return True
 
-    def ssh_node_busy_check(self, ip):
-        assert ip in self.remote_machines.keys(), (
+    def _get_busy_check_script(self, tasks: List[Dict[str, Any]]) -> bytes:
+        "All the tasks of a node are checked within a single remote shell"
+        return self.engines.get_tasks_check_script(
+            [(t["task_id"], t["remote_folder"], t["engine"]) for t in tasks],
+            TASK_PID_FILE,
+        ).encode("utf-8")
+
+    def _parse_busy_check(
+        self, ip: str, tasks: List[Dict[str, Any]], output: str
+    ) -> Dict[int, Optional[bool]]:
+        busy_tasks = self.engines.parse_check_output(output)
+        if set(busy_tasks) != set(t["task_id"] for t in tasks):
+            raise RuntimeError(f"Node {ip} returned malformed check output")
+        return busy_tasks
+
+    def ssh_node_busy_check(
+        self, ip: str, tasks: List[Dict[str, Any]]
+    ) -> Dict[int, Optional[bool]]:
+        "Check which of the node tasks are still running, None if unknown"
+        assert ip in self.remote_users.keys(), (
             f"Node {ip} was referred by active task," " however absent in node list"
         )
-        machine = self.remote_machines[ip]
-
-        for engine in self.engines.values():
-            if engine.check_pname:
-                for _ in machine.pgrep(engine.check_pname):
-                    return True
-            if engine.check_cmd:
+        _, output, _ = self.ssh_exec(ip, "sh", self._get_busy_check_script(tasks))
+        return self._parse_busy_check(ip, tasks, output)
+
+    def ssh_tasks_busy_check(
+        self, tasks: List[Dict[str, Any]]
+    ) -> Dict[int, Optional[bool]]:
+        """
+        Check running tasks, all the nodes concurrently. The task is
+        considered running if its node check failed or did not finish in time.
+        The state is None if the task has no process id on the node.
+        """
+        node_tasks: Dict[str, List[Dict[str, Any]]] = {}
+        for task in tasks:
+            node_tasks.setdefault(task["ip"], []).append(task)
+
+        # busy tasks or the check error by node, absent if timed out
+        checks: Dict[str, Any] = {}
+        if self.async_ssh:
+            ips = list(node_tasks)
+            outputs = self.async_ssh.gather(
+                [
+                    self.async_ssh.run(
+                        ip,
+                        self.remote_users[ip],
+                        "sh",
+                        self._get_busy_check_script(node_tasks[ip]),
+                    )
+                    for ip in ips
+                ],
+                timeout=self.busy_check_timeout,
+            )
+            for ip, output in zip(ips, outputs):
+                if isinstance(output, asyncio.TimeoutError):
+                    continue
+                try:
+                    if isinstance(output, Exception):
+                        raise output
+                    checks[ip] = self._parse_busy_check(ip, node_tasks[ip], output[1])
+                except Exception as e:
+                    checks[ip] = e
+        else:
+            for ip in node_tasks:
+                # do not pile up checks on a hanging node
+                if ip not in self._busy_checks or self._busy_checks[ip].done():
+                    future = self._busy_check_pool.submit(
+                        self.ssh_node_busy_check, ip, node_tasks[ip]
+                    )
+                    self._busy_checks[ip] = future
+            futures = {ip: self._busy_checks[ip] for ip in node_tasks}
+            wait(futures.values(), timeout=self.busy_check_timeout)
+            for ip, future in futures.items():
+                if not future.done():
+                    continue
+                del self._busy_checks[ip]
                 try:
-                    code = machine.cmd.sh["-c", engine.check_cmd].run_retcode()
-                    if code == engine.check_cmd_code:
-                        return True
-                except ProcessExecutionError as e:
-                    self._log.info(f"Node {ip} failed command: {e}")
-        return False
+                    checks[ip] = future.result()
+                except Exception as e:
+                    checks[ip] = e
+
+        result: Dict[int, Optional[bool]] = {task["task_id"]: True for task in tasks}
+        for ip in node_tasks:
+            if ip not in checks:
+                self._log.warning(f"Node {ip} busy check timed out")
+                continue
+            if isinstance(checks[ip], Exception):
+                self._log.error(f"Node {ip} busy check failed: {checks[ip]}")
+                continue
+            for task in node_tasks[ip]:
+                result[task["task_id"]] = checks[ip].get(task["task_id"], True)
+        return result
 
     def ssh_get_task(
         self, ip, engine_name, work_folder, store_folder: Path, remove=True
     ):
-        machine = self.remote_machines[ip]
-        r_work_folder = machine.path(work_folder)
         engine = self.engines[engine_name]
+        if self.async_ssh:
+            self._async_get_task(ip, engine, work_folder, store_folder, remove)
+            return
+        with self.ssh_node(ip) as machine:
+            r_work_folder = machine.path(work_folder)
+            if self.fetch_compression == "gzip":
+                self._ssh_get_task_stream(machine, r_work_folder, engine, store_folder)
+            else:
+                for output_file in engine.output_files:
+                    try:
+                        machine.download(
+                            r_work_folder.join(output_file),
+                            store_folder / output_file,
+                        )
+                    except IOError as err:
+                        # TODO handle that situation properly
+                        self._log.error(
+                            "Cannot scp %s/%s: %s" % (work_folder, output_file, err)
+                        )
+                        if "Connection timed out" in str(err):
+                            break
+
+        if remove:
+            self.ssh_remove_task(ip, work_folder)
+
+    def _async_get_task(
+        self, ip, engine: Engine, work_folder, store_folder: Path, remove: bool
+    ) -> None:
+        """
+        Download all the task outputs at once with the asyncssh backend.
+        The files are copied one by one whatever `fetch_compression` is,
+        the blocks of every file are requested in parallel instead.
+        Missing outputs are skipped, other failures are raised
+        and the remote folder is kept for the next attempt.
+        """
+        user = self.remote_users[ip]
+        results = self.async_ssh.gather(
+            [
+                self.async_ssh.download(
+                    ip, user, f"{work_folder}/{x}", store_folder / x
+                )
+                for x in engine.output_files
+            ]
+        )
+        for output_file, err in zip(engine.output_files, results):
+            if isinstance(err, FileNotFoundError):
+                self._log.error(
+                    "Cannot scp %s/%s: %s" % (work_folder, output_file, err)
+                )
+            elif isinstance(err, Exception):
+                raise err
+        if remove:
+            self.async_ssh.call(self.async_ssh.delete(ip, user, str(work_folder)))
+
+    def _ssh_get_task_stream(
+        self,
+        machine: MyParamikoMachine,
+        r_work_folder,
+        engine: Engine,
+        store_folder: Path,
+    ) -> None:
+        """
+        Download the task outputs as a single gzipped tar stream.
+        The outputs present in the task folder must be received.
+        """
+        sizes = {
+            x.filename: x.st_size for x in machine.sftp.listdir_attr(str(r_work_folder))
+        }
+        fetched = set()
+
+        # large files are downloaded by ranges in parallel instead
+        small_files = []
         for output_file in engine.output_files:
-            try:
+            if sizes.get(output_file, 0) >= CHUNKED_DOWNLOAD_THRESHOLD:
                 machine.download(
-                    r_work_folder.join(output_file),
-                    store_folder / output_file,
+                    r_work_folder.join(output_file), store_folder / output_file
                 )
-            except IOError as err:
-                # TODO handle that situation properly
+                fetched.add(output_file)
+            else:
+                small_files.append(output_file)
+        if not small_files:
+            return
+
+        # missing files are skipped by tar, so are reported below
+        cmd = "cd {} && tar czf - {} 2>/dev/null".format(
+            quote(str(r_work_folder)),
+            " ".join(quote(x) for x in small_files),
+        )
+        stream = machine.exec_output(cmd)
+        try:
+            with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+                for member in tar:
+                    if not member.isfile() or member.name not in small_files:
+                        continue
+                    dst = store_folder / member.name
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    with open(dst, "wb") as f:
+                        shutil.copyfileobj(tar.extractfile(member), f)
+                    fetched.add(member.name)
+        except tarfile.ReadError:
+            # an empty stream is fine if nothing could be packed, see below
+            pass
+        finally:
+            stream.channel.close()
+
+        lost = [x for x in small_files if x in sizes and x not in fetched]
+        if lost:
+            raise IOError("Broken output stream, not received: " + ", ".join(lost))
+        for output_file in engine.output_files:
+            if output_file not in fetched:
                 self._log.error(
-                    "Cannot scp %s/%s: %s" % (work_folder, output_file, err)
+                    "Cannot fetch %s/%s: no such file" % (r_work_folder, output_file)
                 )
-                if "Connection timed out" in str(err):
-                    break
 
-        if remove:
-            r_work_folder.delete()
+    def ssh_remove_task(self, ip, work_folder):
+        if self.async_ssh:
+            self.async_ssh.call(
+                self.async_ssh.delete(ip, self.remote_users[ip], str(work_folder))
+            )
+            return
+        # a plain command keeps off the shell session shared by threads
+        code, _, err = self.ssh_exec(ip, "rm -rf {}".format(quote(str(work_folder))))
+        if code != 0:
+            raise IOError(err.strip())
+
+    def fetch_task(self, task_id: int) -> None:
+        "Schedule results retrieval in the background"
+        if task_id in self._fetching:
+            return
+        if task_id in self._fetch_retries:
+            if time.monotonic() < self._fetch_retries[task_id][1]:
+                return
+        task = self.queue_get_task(task_id)
+        if not task:
+            return
+        local_folder = task["metadata"].get("local_folder")
+        remote_folder = task["metadata"]["remote_folder"]
+        if local_folder:
+            store_folder = Path(local_folder)
+        else:
+            store_folder = self.local_tasks_dir / Path(remote_folder).name
+        store_folder.mkdir(parents=True, exist_ok=True)
+        t = FetchTask(
+            task_id=task_id,
+            ip=task["ip"],
+            engine_name=task["metadata"]["engine"],
+            remote_folder=remote_folder,
+            store_folder=store_folder,
+        )
+        self._fetching.add(task_id)
+        self._fetch_queue.put(t)
 
-    def clouds_allocate(self, on_task):
-        if self.clouds:
-            self.clouds.allocate(on_task)
+    def process_fetched(self) -> None:
+        while not self._fetch_results.empty():
+            try:
+                r = self._fetch_results.get(False)
+            except queue.Empty:
+                break
+
+            self._fetching.discard(r.task_id)
+            # failed retrieval is retried on the next step until timed out
+            give_up = not r.fetched and self.queue_is_fetch_timed_out(r.task_id)
+            if give_up:
+                self._log.error(
+                    "Results of task_id={} are not fetched in {} seconds, "
+                    "giving up".format(r.task_id, self.fetch_timeout)
+                )
+            if r.fetched or give_up:
+                self._fetch_retries.pop(r.task_id, None)
+            else:
+                attempts = self._fetch_retries.get(r.task_id, (0, 0))[0] + 1
+                delay = min(
+                    FETCH_RETRY_DELAY * 2 ** (attempts - 1), FETCH_RETRY_MAX_DELAY
+                )
+                self._fetch_retries[r.task_id] = (attempts, time.monotonic() + delay)
+            if r.fetched or give_up:
+                ready_task = self.queue_get_task(r.task_id)
+                if ready_task:
+                    webhook_url = ready_task["metadata"].get("webhook_url")
+                    metadata = dict(
+                        remote_folder=ready_task["metadata"]["remote_folder"],
+                        local_folder=str(r.store_folder),
+                    )
+                    if webhook_url:
+                        metadata["webhook_url"] = webhook_url
+                    self.queue_set_task_done(r.task_id, metadata)
+                    if r.fetched:
+                        self._log.info(
+                            ":::task_id={} {} done and saved in {}".format(
+                                r.task_id, ready_task["label"], r.store_folder
+                            )
+                        )
+            self._fetch_results.task_done()
 
     def clouds_deallocate(self, ips):
         if self.clouds:
             self.clouds.deallocate(ips)
 
-    def clouds_get_capacity(self, resources):
+    def clouds_get_deallocatable(self, free_nodes: List[str]) -> List[str]:
+        if self.clouds:
+            return self.clouds.get_deallocatable(free_nodes)
+        return []
+
+    def clouds_autoscale(self, free_nodes: List[str]) -> List[str]:
         if self.clouds:
-            return self.clouds.get_capacity(resources)
-        return 0
+            return self.clouds.autoscale(free_nodes)
+        return []
+
+    def get_node_image_hash(self) -> str:
+        """
+        Hash of the node setup: the packages and the engines installed.
+        Nodes booted from the image baked for this hash are ready to run tasks.
+        """
+        engines = self.engines.filter_platforms(["debian-10"])
+        setup = {
+            "packages": sorted(engines.get_platform_packages()),
+            "engines_dir": str(self.remote_engines_dir),
+            "engines": {
+                name: engine.get_deploy_hashes(self.local_engines_dir / name)
+                for name, engine in engines.items()
+            },
+        }
+        return hashlib.sha256(
+            json.dumps(setup, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
 
     def setup_node(self, ip: str, user: str) -> None:
         """Provision a debian-like node"""
@@ -379,14 +1142,18 @@ class Yascheduler:
             self._log.error("There is not supported engines!")
             return
 
-        machine = MyParamikoMachine.create_machine(
-            host=ip,
-            user=user,
-            keys_dir=self.local_keys_dir,
-        )
+        machine = self.ssh_pool.get(ip, user)
+
+        # the node booted from the up-to-date image is set up already
+        image_hash = self.get_node_image_hash()
+        image_path = machine.path(self.remote_data_dir).join(NODE_IMAGE_FILE)
+        if image_path.exists() and image_path.read().strip() == image_hash:
+            self._log.info(f"Node is set up from image {image_hash}")
+            return
 
         # print OS version
-        result = machine.session().run("source /etc/os-release; echo $PRETTY_NAME")
+        with machine.session() as session:
+            result = session.run("source /etc/os-release; echo $PRETTY_NAME")
         self._log.info("OS: {}".format(result[1].strip()))
 
         # print CPU count
@@ -418,20 +1185,45 @@ class Yascheduler:
             local_engine_dir = self.local_engines_dir / engine.name
             remote_engine_dir = machine.path(self.remote_engines_dir).join(engine.name)
             remote_engine_dir.mkdir(parents=True)
+
+            # the artifacts deployed already are skipped
+            hashes = engine.get_deploy_hashes(local_engine_dir)
+            manifest_path = remote_engine_dir.join(ENGINE_MANIFEST_FILE)
+            try:
+                manifest = json.loads(manifest_path.read())
+            except Exception:
+                manifest = {}
+
+            def is_deployed(key: str) -> bool:
+                return manifest.get(key) == hashes[key]
+
+            def set_deployed(key: str) -> None:
+                manifest[key] = hashes[key]
+                manifest_path.write(json.dumps(manifest, indent=2))
+
             for deployment in engine.deployable:
                 # uploading binary from local; requires broadband connection
                 if isinstance(deployment, LocalFilesDeploy):
                     for filepath in deployment.files:
                         rfpath = remote_engine_dir.join(filepath)
+                        key = f"file:{filepath}"
+                        if is_deployed(key) and rfpath.exists():
+                            self._log.info(f"{rfpath} is up to date")
+                            continue
                         self._log.info(f"Uploading {filepath} to {rfpath}")
                         machine.upload(local_engine_dir / filepath, rfpath)
                         machine.cmd.chmod("+x", rfpath)
+                        set_deployed(key)
 
                 # upload local archive
                 # binary may be gzipped, without subfolders,
                 # with an arbitrary archive name
                 if isinstance(deployment, LocalArchiveDeploy):
                     fn = deployment.filename
+                    key = f"archive:{fn}"
+                    if is_deployed(key):
+                        self._log.info(f"{fn} is up to date")
+                        continue
                     apath = local_engine_dir / fn
                     rpath = remote_engine_dir.join(fn)
                     self._log.info(f"Uploading {fn} to {rpath}...")
@@ -440,10 +1232,15 @@ class Yascheduler:
                     tar = machine.cmd.tar
                     tar["xfv", fn].with_cwd(remote_engine_dir).run()
                     rpath.delete()
+                    set_deployed(key)
 
                 # downloading binary from a trusted non-public address
                 if isinstance(deployment, RemoteArchiveDeploy):
                     url = deployment.url
+                    key = f"url:{url}"
+                    if is_deployed(key):
+                        self._log.info(f"{url} is up to date")
+                        continue
                     fn = "archive.tar.gz"
                     rpath = remote_engine_dir.join(fn)
                     self._log.info(f"Downloading {url} to {rpath}...")
@@ -453,12 +1250,23 @@ class Yascheduler:
                     tar = machine.cmd.tar
                     tar["xfv", fn].with_cwd(remote_engine_dir).run()
                     rpath.delete()
+                    set_deployed(key)
+
+        image_path.write(image_hash)
 
     def stop(self):
         self._log.info("Stopping threads...")
-        for t in self._webhook_threads:
+        workers: List[BackgroundWorker] = []
+        workers.extend(self._webhook_threads)
+        workers.extend(self._fetch_threads)
+        for t in workers:
             t.stop()
+        for t in workers:
             t.join()
+        self._busy_check_pool.shutdown(wait=False)
+        self.ssh_pool.close()
+        if self.async_ssh:
+            self.async_ssh.stop()
 
 
 def daemonize(log_file=None):
@@ -467,6 +1275,10 @@ def daemonize(log_file=None):
     config.read(CONFIG_FILE)
 
     yac = Yascheduler(config)
+    if get_schema_version(yac.cursor) < get_latest_version():
+        logger.error("Database schema is outdated, please run yainit")
+        yac.connection.close()
+        sys.exit(1)
     clouds = yascheduler.clouds.CloudAPIManager(config, logger=logger)
     yac.clouds = clouds
     clouds.yascheduler = yac
@@ -474,8 +1286,7 @@ def daemonize(log_file=None):
     logging.getLogger("Yascheduler").setLevel(logging.DEBUG)
     clouds.initialize()
     yac.start()
-
-    chilling_nodes = Counter()  # ips vs. their occurences
+    listener = DBListener(config, logger=logger)
 
     logger.debug(
         "Available computing engines: %s"
@@ -487,90 +1298,86 @@ def daemonize(log_file=None):
         all_nodes = [
             item[0] for item in resources if "." in item[0]
         ]  # NB provision nodes have fake ips
-        if sorted(yac.remote_machines.keys()) != sorted(all_nodes):
-            yac.ssh_connect(all_nodes)
+        # the nodes are shared with other daemons
+        owned_nodes, nodes_share = yac.queue_acquire_nodes(all_nodes)
+        if sorted(yac.remote_users.keys()) != sorted(owned_nodes):
+            yac.ssh_connect(owned_nodes)
 
         enabled_nodes: Dict[str, int] = {
-            item[0]: item[1] for item in resources if item[2]
+            item[0]: item[1] for item in resources if item[2] and item[0] in owned_nodes
         }
-        free_nodes = list(enabled_nodes.keys())
+        # node slots are its CPUs; the nodes are skipped until they are known
+        node_ncpus: Dict[str, int] = {}
+        for ip, ncpus in enabled_nodes.items():
+            ncpus = yac.ssh_get_ncpus(ip, ncpus)
+            if ncpus:
+                node_ncpus[ip] = ncpus
+        used_cpus: "Counter[str]" = Counter()
 
         # (I.) Tasks de-allocation clause
-        tasks_running = yac.queue_get_tasks(status=(yac.STATUS_RUNNING,))
+        yac.process_fetched()
+        tasks_running = yac.queue_get_running_tasks(owned_nodes)
         logger.debug("running %s tasks: %s" % (len(tasks_running), tasks_running))
+        busy_tasks = yac.ssh_tasks_busy_check(
+            [task for task in tasks_running if task["status"] == yac.STATUS_RUNNING]
+        )
         for task in tasks_running:
-            if yac.ssh_node_busy_check(task["ip"]):
-                try:
-                    free_nodes.remove(task["ip"])
-                except ValueError:
-                    pass
-            else:
-                ready_task = yac.queue_get_task(task["task_id"])
-                webhook_url = ready_task["metadata"].get("webhook_url")
-                local_folder = ready_task["metadata"].get("local_folder")
-                remote_folder = ready_task["metadata"]["remote_folder"]
-                if local_folder:
-                    store_folder = Path(local_folder)
-                else:
-                    store_folder = yac.local_tasks_dir / Path(remote_folder).name
-                store_folder.mkdir(parents=True, exist_ok=True)
-                yac.ssh_get_task(
-                    ready_task["ip"],
-                    ready_task["metadata"]["engine"],
-                    ready_task["metadata"]["remote_folder"],
-                    store_folder,
-                )
-                ready_task["metadata"] = dict(
-                    remote_folder=ready_task["metadata"]["remote_folder"],
-                    local_folder=str(store_folder),
-                )
-                if webhook_url:
-                    ready_task["metadata"]["webhook_url"] = webhook_url
-                yac.queue_set_task_done(ready_task["task_id"], ready_task["metadata"])
-                logger.info(
-                    ":::task_id={} {} done and saved in {}".format(
-                        task["task_id"],
-                        ready_task["label"],
-                        ready_task["metadata"].get("local_folder"),
+            # the task occupies its CPUs until results are copied
+            used_cpus[task["ip"]] += task["ncpus"] or node_ncpus.get(task["ip"], 0)
+            if task["status"] == yac.STATUS_RUNNING:
+                busy = busy_tasks[task["task_id"]]
+                if busy:
+                    continue
+                if busy is None and not task["started_at"]:
+                    # claimed, but the daemon stopped before spawning it
+                    logger.warning(
+                        "task_id=%s was not started, back to the queue"
+                        % task["task_id"]
                     )
-                )
-                # TODO here we might want to notify our data consumers in an event-driven manner
-                # TODO but how to do it quickly or in the background?
+                    yac.queue_set_task_to_do(task["task_id"])
+                    continue
+                yac.queue_set_task_fetching(task["task_id"])
+            # also resumes retrieval interrupted by the daemon restart
+            yac.fetch_task(task["task_id"])
+
+        free_cpus = {
+            ip: max(0, ncpus - used_cpus[ip]) for ip, ncpus in node_ncpus.items()
+        }
+        free_nodes = [ip for ip in free_cpus if not used_cpus[ip]]
+
+        # give away idle nodes above the fair share
+        if len(owned_nodes) > nodes_share and free_nodes:
+            excess = free_nodes[: len(owned_nodes) - nodes_share]
+            yac.queue_release_nodes(excess)
+            free_nodes = [ip for ip in free_nodes if ip not in excess]
+            for ip in excess:
+                del free_cpus[ip]
 
         # (II.) Resourses and tasks allocation clause
-        clouds_capacity = yac.clouds_get_capacity(resources)
-        if free_nodes or clouds_capacity:
-            for task in yac.queue_get_tasks_to_do(clouds_capacity + len(free_nodes)):
-                if not free_nodes:
-                    yac.clouds_allocate(task["task_id"])
-                    continue
-                random.shuffle(free_nodes)
-                ip = free_nodes.pop()
-                logger.info(
-                    ":::submitting task_id=%s %s to %s"
-                    % (task["task_id"], task["label"], ip)
-                )
+        for task in yac.queue_claim_tasks_to_do(free_cpus, node_ncpus):
+            ip = task["ip"]
+            logger.info(
+                ":::submitting task_id=%s %s to %s"
+                % (task["task_id"], task["label"], ip)
+            )
 
-                if yac.ssh_run_task(
-                    ip, enabled_nodes[ip], task["label"], task["metadata"]
-                ):
-                    yac.queue_set_task_running(task["task_id"], ip)
+            if yac.ssh_run_task(ip, task["ncpus"], task["label"], task["metadata"]):
+                yac.queue_set_task_running(task["task_id"], ip)
+            else:
+                yac.queue_set_task_to_do(task["task_id"])
+        free_nodes = [ip for ip in free_nodes if free_cpus[ip] == node_ncpus[ip]]
+        yac.queue_set_nodes_busy([ip for ip in free_cpus if ip not in free_nodes])
+
+        # the rest of tasks don't fit the free CPUs, the idle nodes
+        # are kept for the expected tasks
+        warm_nodes = yac.clouds_autoscale(free_nodes)
 
         # (III.) Resourses de-allocation clause
-        if free_nodes:  # candidates for removal
-            chilling_nodes.update(free_nodes)
-            deallocatable = Counter(
-                [
-                    x[0]
-                    for x in filter(
-                        lambda x: x[1] >= N_IDLE_PASSES,
-                        chilling_nodes.most_common(),
-                    )
-                ]
-            )
-            if deallocatable:
-                yac.clouds_deallocate(list(deallocatable.elements()))
-                chilling_nodes.subtract(deallocatable)
+        deallocatable = yac.clouds_get_deallocatable(
+            [ip for ip in free_nodes if ip not in warm_nodes]
+        )
+        if deallocatable:
+            yac.clouds_deallocate(deallocatable)
 
         # process results of allocators
         clouds.do_async_work()
@@ -579,15 +1386,18 @@ def daemonize(log_file=None):
         nodes = yac.queue_get_resources()
         enabled_nodes = list(filter(lambda x: x[2], nodes))
         logger.info(
-            "NODES:\tenabled: %s\ttotal: %s",
+            "NODES:\tenabled: %s\ttotal: %s\towned: %s",
             str(len(enabled_nodes)),
             str(len(nodes)),
+            str(len(owned_nodes)),
         )
+        counts = yac.queue_count_by_status()
         logger.info(
-            "TASKS:\trunning: %s\tto do: %s\tdone: %s",
-            len(yac.queue_get_tasks(status=(yac.STATUS_RUNNING,))),
-            len(yac.queue_get_tasks(status=(yac.STATUS_TO_DO,))),
-            len(yac.queue_get_tasks(status=(yac.STATUS_DONE,))),
+            "TASKS:\trunning: %s\tfetching: %s\tto do: %s\tdone: %s",
+            counts[yac.STATUS_RUNNING],
+            counts[yac.STATUS_FETCHING],
+            counts[yac.STATUS_TO_DO],
+            counts[yac.STATUS_DONE],
         )
 
     # The main scheduler loop
@@ -595,8 +1405,13 @@ def daemonize(log_file=None):
         while True:
             end_time = datetime.now() + timedelta(seconds=SLEEP_INTERVAL)
             step()
-            sleep_until(end_time)
+            # wake up on events, the timer is a fallback
+            events = listener.wait_until(end_time)
+            if events:
+                logger.debug("Events received: %s" % ", ".join(sorted(set(events))))
     except KeyboardInterrupt:
+        yac.queue_release_nodes()
+        listener.close()
         clouds.stop()
         yac.stop()
 
@@ -1,13 +1,221 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from functools import partial
 from pathlib import Path
-from typing import Optional
+from shlex import quote
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
+from paramiko.channel import ChannelFile
 from paramiko.client import AutoAddPolicy
+from paramiko.sftp_client import SFTPClient
 from paramiko.ssh_exception import AuthenticationException
 from plumbum.machines.paramiko_machine import ParamikoMachine
 
+from yascheduler import (
+    CHUNKED_DOWNLOAD_CHUNK_SIZE,
+    CHUNKED_DOWNLOAD_THREADS,
+    CHUNKED_DOWNLOAD_THRESHOLD,
+)
+
+# size of a single pipelined read request batch
+READ_BLOCK_SIZE = 1024 * 1024
+# flow control window of every transfer channel
+SFTP_WINDOW_SIZE = 16 * 1024 * 1024
+# key file names by user@host, in the keys directory
+KEYS_CACHE_FILE = ".keys_cache.json"
+
+
+class ChunkedDownload(object):
+    """
+    Download of a large file by ranges over several SFTP channels.
+    The ranges are written into a preallocated ``<dst>.part`` file and
+    the finished ones are recorded in ``<dst>.part.json``, so an interrupted
+    download is resumed. The result is verified against remote sha256sum.
+    """
+
+    _log: logging.Logger
+
+    def __init__(
+        self,
+        machine: "MyParamikoMachine",
+        src: str,
+        dst: Path,
+        chunk_size: int = CHUNKED_DOWNLOAD_CHUNK_SIZE,
+        threads: int = CHUNKED_DOWNLOAD_THREADS,
+    ):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.machine = machine
+        self.src = src
+        self.dst = dst
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.part_path = dst.with_name(dst.name + ".part")
+        self.state_path = dst.with_name(dst.name + ".part.json")
+        self._lock = threading.Lock()
+
+    def _load_done(self, state: dict) -> Set[int]:
+        "Chunks finished by a previous attempt on the same remote file"
+        try:
+            saved = json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            return set()
+        if not self.part_path.exists() or any(
+            saved.get(k) != v for k, v in state.items()
+        ):
+            return set()
+        return set(saved.get("done", []))
+
+    def _save_done(self, state: dict, done: Set[int]) -> None:
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(dict(state, done=sorted(done))))
+        os.replace(tmp_path, self.state_path)
+
+    def _open_sftp(self) -> SFTPClient:
+        transport = self.machine._client.get_transport()
+        return SFTPClient.from_transport(transport, window_size=SFTP_WINDOW_SIZE)
+
+    def _fetch_chunks(
+        self, fd: int, chunks: List[int], size: int, state: dict, done: Set[int]
+    ) -> None:
+        sftp = self._open_sftp()
+        try:
+            with sftp.open(self.src, "rb") as f:
+                for chunk in chunks:
+                    start = chunk * self.chunk_size
+                    end = min(start + self.chunk_size, size)
+                    blocks = [
+                        (offset, min(READ_BLOCK_SIZE, end - offset))
+                        for offset in range(start, end, READ_BLOCK_SIZE)
+                    ]
+                    # readv pipelines all the requests of the chunk
+                    for (offset, _), data in zip(blocks, f.readv(blocks)):
+                        os.pwrite(fd, data, offset)
+                    with self._lock:
+                        done.add(chunk)
+                        self._save_done(state, done)
+        finally:
+            sftp.close()
+
+    def _remote_checksum(self) -> Optional[ChannelFile]:
+        try:
+            return self.machine.exec_output(
+                "sha256sum -- {} 2>/dev/null".format(quote(self.src))
+            )
+        except Exception as err:
+            self._log.warning(f"Can't checksum {self.src}: {str(err)}")
+            return None
+
+    def _local_checksum(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.part_path, "rb") as f:
+            for data in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                digest.update(data)
+        return digest.hexdigest()
+
+    def run(self) -> None:
+        attrs = self.machine.sftp.stat(self.src)
+        size = attrs.st_size
+        state = dict(size=size, mtime=attrs.st_mtime, chunk_size=self.chunk_size)
+        done = self._load_done(state)
+        n_chunks = (size + self.chunk_size - 1) // self.chunk_size
+        todo = [x for x in range(n_chunks) if x not in done]
+        if done:
+            self._log.info(
+                f"Resuming {self.src}: {len(done)} of {n_chunks} chunks are ready"
+            )
+        # the remote side is hashed meanwhile
+        checksum_stream = self._remote_checksum()
+
+        fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                if hasattr(os, "posix_fallocate") and size:
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+            if todo:
+                threads = max(1, min(self.threads, len(todo)))
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    futures = [
+                        executor.submit(
+                            self._fetch_chunks, fd, todo[i::threads], size, state, done
+                        )
+                        for i in range(threads)
+                    ]
+                    for future in futures:
+                        future.result()
+        finally:
+            os.close(fd)
+
+        if checksum_stream:
+            remote = checksum_stream.read().decode("utf-8", "replace").split(" ")[0]
+            checksum_stream.channel.close()
+            if not remote:
+                self._log.warning(f"Can't checksum {self.src}, skipping verification")
+            elif remote != self._local_checksum():
+                self.part_path.unlink()
+                self.state_path.unlink()
+                raise IOError(f"Checksum mismatch of {self.src}")
+
+        os.replace(self.part_path, self.dst)
+        self.state_path.unlink()
+
+
+class KeysCache(object):
+    """
+    Key file which worked for every user@host, saved in the keys directory.
+    Shared by all the connections of the process.
+    """
+
+    _lock = threading.Lock()
+    _caches: Dict[Path, Dict[str, str]] = {}
+
+    def __init__(self, keys_dir: Path):
+        self.path = keys_dir / KEYS_CACHE_FILE
+
+    def _load(self) -> Dict[str, str]:
+        if self.path not in self._caches:
+            try:
+                self._caches[self.path] = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self._caches[self.path] = {}
+        return self._caches[self.path]
+
+    def _save(self, cache: Dict[str, str]) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp_path.write_text(json.dumps(cache, indent=2, sort_keys=True))
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # still cached in memory
+            pass
+
+    def get(self, host: str, user: str) -> Optional[str]:
+        with self._lock:
+            return self._load().get(f"{user}@{host}")
+
+    def set(self, host: str, user: str, key_name: Optional[str]) -> None:
+        with self._lock:
+            cache = self._load()
+            if cache.get(f"{user}@{host}") == key_name:
+                return
+            if key_name:
+                cache[f"{user}@{host}"] = key_name
+            else:
+                cache.pop(f"{user}@{host}", None)
+            self._save(cache)
+
 
 class MyParamikoMachine(ParamikoMachine):
     @classmethod
@@ -20,8 +228,19 @@ class MyParamikoMachine(ParamikoMachine):
         **kwargs,
     ) -> "MyParamikoMachine":
         keys_paths = []
+        keys_cache = None
         if keys_dir:
-            keys_paths = list(filter(lambda x: x.is_file(), keys_dir.iterdir()))
+            keys_paths = [
+                x
+                for x in sorted(keys_dir.iterdir())
+                if x.is_file() and not x.name.startswith(".")
+            ]
+            keys_cache = KeysCache(keys_dir)
+
+            # the key which worked last time is tried first
+            cached_key = keys_cache.get(host, user)
+            if cached_key:
+                keys_paths.sort(key=lambda x: x.name != cached_key)
 
         connect = partial(
             cls,
@@ -33,8 +252,155 @@ class MyParamikoMachine(ParamikoMachine):
 
         for keyfile in keys_paths:
             try:
-                return connect(keyfile=str(keyfile))
+                machine = connect(keyfile=str(keyfile))
             except AuthenticationException:
-                pass
+                continue
+            if keys_cache:
+                keys_cache.set(host, user, keyfile.name)
+            return machine
 
+        if keys_cache:
+            keys_cache.set(host, user, None)
         return connect()
+
+    def exec_with_input(self, cmd: str, data: bytes) -> Tuple[int, str, str]:
+        "Run :cmd: in a single exec channel feeding :data: to its stdin"
+        stdin, stdout, stderr = self._client.exec_command(cmd)
+        stdin.write(data)
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        out = stdout.read().decode(self.custom_encoding, "replace")
+        err = stderr.read().decode(self.custom_encoding, "replace")
+        return stdout.channel.recv_exit_status(), out, err
+
+    def exec_output(self, cmd: str) -> ChannelFile:
+        "Run :cmd: in a single exec channel and return its stdout stream"
+        stdin, stdout, _ = self._client.exec_command(cmd)
+        stdin.channel.shutdown_write()
+        return stdout
+
+    def download(self, src, dst) -> None:
+        "Download with large files transferred by ranges in parallel"
+        attrs = self.sftp.stat(str(src))
+        if stat.S_ISREG(attrs.st_mode) and attrs.st_size >= CHUNKED_DOWNLOAD_THRESHOLD:
+            dst = Path(str(dst))
+            if dst.is_dir():
+                dst = dst / Path(str(src)).name
+            ChunkedDownload(self, str(src), dst).run()
+        else:
+            super().download(src, dst)
+
+
+@dataclass
+class SSHPoolEntry:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    machine: Optional[MyParamikoMachine] = None
+    checked_at: float = 0
+
+
+class SSHPool(object):
+    """
+    Thread-safe SSH connections shared by (host, user).
+    The connections are kept alive, checked before use and reopened
+    on demand when broken. Concurrent operations per host are limited.
+    """
+
+    _log: logging.Logger
+    _lock: threading.Lock
+    _entries: Dict[Tuple[str, str], SSHPoolEntry]
+    _channels: Dict[str, threading.BoundedSemaphore]
+
+    def __init__(
+        self,
+        keys_dir: Optional[Path] = None,
+        keepalive_interval: int = 30,
+        health_check_interval: float = 60,
+        max_channels: int = 8,
+        logger: Optional[logging.Logger] = None,
+    ):
+        if logger:
+            self._log = logger.getChild(self.__class__.__name__)
+        else:
+            self._log = logging.getLogger(self.__class__.__name__)
+        self.keys_dir = keys_dir
+        self.keepalive_interval = keepalive_interval
+        self.health_check_interval = health_check_interval
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._channels = {}
+
+    def _get_entry(self, host: str, user: str) -> SSHPoolEntry:
+        with self._lock:
+            if host not in self._channels:
+                self._channels[host] = threading.BoundedSemaphore(self.max_channels)
+            return self._entries.setdefault((host, user), SSHPoolEntry())
+
+    @staticmethod
+    def _is_active(machine: MyParamikoMachine) -> bool:
+        transport = machine._client.get_transport()
+        return bool(transport and transport.is_active())
+
+    def _is_alive(self, entry: SSHPoolEntry) -> bool:
+        if not entry.machine or not self._is_active(entry.machine):
+            return False
+        now = time.monotonic()
+        if now - entry.checked_at >= self.health_check_interval:
+            try:
+                entry.machine._client.get_transport().send_ignore()
+            except Exception:
+                return False
+            entry.checked_at = now
+        return True
+
+    @staticmethod
+    def _close_machine(machine: MyParamikoMachine) -> None:
+        try:
+            machine.close()
+        except Exception:
+            pass
+
+    def get(self, host: str, user: str, **kwargs) -> MyParamikoMachine:
+        "Live connection, opened if necessary"
+        entry = self._get_entry(host, user)
+        with entry.lock:
+            if entry.machine and not self._is_alive(entry):
+                self._log.info(f"Reconnecting to {user}@{host}...")
+                self._close_machine(entry.machine)
+                entry.machine = None
+            if not entry.machine:
+                machine = MyParamikoMachine.create_machine(
+                    host=host, user=user, keys_dir=self.keys_dir, **kwargs
+                )
+                machine._client.get_transport().set_keepalive(self.keepalive_interval)
+                entry.machine = machine
+                entry.checked_at = time.monotonic()
+            return entry.machine
+
+    @contextmanager
+    def connection(self, host: str, user: str, **kwargs) -> Iterator[MyParamikoMachine]:
+        "Connection for a single operation; don't nest for the same host"
+        entry = self._get_entry(host, user)
+        with self._channels[host]:
+            machine = self.get(host, user, **kwargs)
+            try:
+                yield machine
+            except Exception:
+                # the broken connection is reopened on the next use
+                if not self._is_active(machine):
+                    with entry.lock:
+                        if entry.machine is machine:
+                            entry.machine = None
+                    self._close_machine(machine)
+                raise
+
+    def close(self, host: Optional[str] = None) -> None:
+        "Close connections to :host: or all of them"
+        with self._lock:
+            keys = [k for k in self._entries if host is None or k[0] == host]
+            entries = [self._entries.pop(k) for k in keys]
+        for entry in entries:
+            with entry.lock:
+                if entry.machine:
+                    self._close_machine(entry.machine)
+                    entry.machine = None
@@ -3,25 +3,53 @@ Console scripts for yascheduler
 """
 import os
 import argparse
+import json
+import logging
 from configparser import ConfigParser
 from pathlib import Path
 
-from pg8000 import ProgrammingError
 from plumbum import local
 from plumbum.commands.processes import ProcessExecutionError
 
-from yascheduler import has_node, add_node, remove_node
-from yascheduler.ssh import MyParamikoMachine
-from yascheduler.variables import CONFIG_FILE
+from yascheduler import connect_db, has_node, add_node, remove_node
+from yascheduler.clouds.abstract_cloud_api import load_cloudapi
+from yascheduler.migrations import migrate, split_sql
+from yascheduler.rollout import EngineRollout
+from yascheduler.variables import CONFIG_FILE, SUBMIT_BATCH_SIZE
 from yascheduler.scheduler import Yascheduler
 
 
 def submit():
     parser = argparse.ArgumentParser(description="Submit task to yascheduler daemon")
-    parser.add_argument("script")
+    parser.add_argument("script", nargs="?")
+    parser.add_argument(
+        "-b",
+        "--batch",
+        required=False,
+        default=None,
+        help="JSON lines manifest of tasks, see queue_submit_tasks",
+    )
+    parser.add_argument(
+        "-p",
+        "--priority",
+        required=False,
+        default=None,
+        type=int,
+        help="tasks with higher priority are dispatched first",
+    )
+    parser.add_argument(
+        "-n",
+        "--ncpus",
+        required=False,
+        default=None,
+        type=int,
+        help="number of CPUs required, the whole node if not set",
+    )
 
     args = parser.parse_args()
-    if not os.path.isfile(args.script):
+    if args.batch:
+        return _submit_batch(args.batch, args.priority, args.ncpus)
+    if not args.script or not os.path.isfile(args.script):
         raise ValueError("Script parameter is not a file name")
 
     inputs = {}
@@ -35,19 +63,73 @@ def submit():
     config = ConfigParser()
     config.read(CONFIG_FILE)
     yac = Yascheduler(config)
+    priority = args.priority
+    if priority is None:
+        priority = int(inputs.get("PRIORITY", 0))
+    ncpus = args.ncpus
+    if ncpus is None and inputs.get("NCPUS"):
+        ncpus = int(inputs["NCPUS"])
     task_id = yac.queue_submit_task(
         inputs["LABEL"],
         {
-            "structure": open(inputs["STRUCT"]).read(),
-            "input": open(inputs["INPUT"]).read(),
+            "fort.34": open(inputs["STRUCT"]).read(),
+            "INPUT": open(inputs["INPUT"]).read(),
             "local_folder": os.getcwd(),
         },
+        inputs.get("ENGINE", "pcrystal"),
+        priority=priority,
+        ncpus=ncpus,
     )  # TODO
 
     print("Successfully submitted task: {}".format(task_id))
     yac.connection.close()
 
 
+def _submit_batch(manifest: str, priority=None, ncpus=None):
+    """
+    Submit tasks from the JSON lines manifest, a task per line:
+    `{"label": ..., "engine": ..., "metadata": {...}, "files": {...}}`.
+    Input files are set by content in `metadata` or by path in `files`.
+    Optional `priority` and `ncpus` override the defaults.
+    """
+    if not os.path.isfile(manifest):
+        raise ValueError("Manifest is not a file name")
+    base_dir = Path(manifest).parent
+
+    config = ConfigParser()
+    config.read(CONFIG_FILE)
+    yac = Yascheduler(config)
+
+    def submit_tasks(tasks):
+        for task_id in yac.queue_submit_tasks(tasks):
+            print("Successfully submitted task: {}".format(task_id))
+
+    tasks = []
+    with open(manifest) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            metadata = item.get("metadata", {})
+            for name, path in item.get("files", {}).items():
+                metadata[name] = (base_dir / path).read_text()
+            # without local_folder, results go to a folder of their own
+            tasks.append(
+                dict(
+                    label=item["label"],
+                    metadata=metadata,
+                    engine=item["engine"],
+                    priority=item.get("priority", priority),
+                    ncpus=item.get("ncpus", ncpus),
+                )
+            )
+            if len(tasks) >= SUBMIT_BATCH_SIZE:
+                submit_tasks(tasks)
+                tasks = []
+    submit_tasks(tasks)
+    yac.connection.close()
+
+
 def check_status():
     parser = argparse.ArgumentParser(description="Submit task to yascheduler daemon")
     parser.add_argument("-j", "--jobs", required=False, default=None, nargs="*")
@@ -67,6 +149,16 @@ def check_status():
     parser.add_argument(
         "-i", "--info", required=False, default=None, nargs="?", type=bool, const=True
     )
+    parser.add_argument(
+        "-s",
+        "--stats",
+        required=False,
+        default=None,
+        nargs="?",
+        type=bool,
+        const=True,
+        help="show number of tasks by status",
+    )
     # parser.add_argument('-k', '--kill', required=False, default=None, nargs='?', type=bool, const=True)
 
     args = parser.parse_args()
@@ -76,14 +168,23 @@ def check_status():
     statuses = {
         yac.STATUS_TO_DO: "QUEUED",
         yac.STATUS_RUNNING: "RUNNING",
+        yac.STATUS_FETCHING: "FETCHING",
         yac.STATUS_DONE: "FINISHED",
     }
     local_parsing_ready, local_calc_snippet = False, False
 
+    if args.stats:
+        for status, count in yac.queue_count_by_status().items():
+            print("{}\t{}".format(statuses.get(status, status), count))
+        yac.connection.close()
+        return
+
     if args.jobs:
         tasks = yac.queue_get_tasks(jobs=args.jobs)
     else:
-        tasks = yac.queue_get_tasks(status=(yac.STATUS_RUNNING, yac.STATUS_TO_DO))
+        tasks = yac.queue_get_tasks(
+            status=(yac.STATUS_RUNNING, yac.STATUS_FETCHING, yac.STATUS_TO_DO)
+        )
 
     if args.convergence:
         try:
@@ -116,11 +217,8 @@ def check_status():
                 + "ID%s %s at %s@%s:%s"
                 % (row[0], row[1], ssh_user, row[3], row[2]["remote_folder"])
             )
-            machine = MyParamikoMachine.create_machine(
-                host=row[3],
-                user=ssh_user,
-                keys_dir=yac.local_keys_dir,
-            )
+            # the tasks of the same node share the connection
+            machine = yac.ssh_pool.get(row[3], ssh_user)
             try:
                 r_output = machine.path("{}/OUTPUT".format(row[2]["remote_folder"]))
                 result = machine.cmd.tail("-n15", r_output)
@@ -199,6 +297,7 @@ def check_status():
         for task in tasks:
             print("{}   {}".format(task["task_id"], statuses[task["status"]]))
 
+    yac.ssh_pool.close()
     yac.connection.close()
 
     if local_calc_snippet and os.path.exists(local_calc_snippet):
@@ -258,18 +357,20 @@ def _init_db(install_path: Path):
     # database initialization
     config = ConfigParser()
     config.read(CONFIG_FILE)
-    yac = Yascheduler(config)
-    schema = (install_path / "data" / "schema.sql").read_text()
-    try:
-        for line in schema.split(";"):
-            if not line:
-                continue
-            yac.cursor.execute(line)
-        yac.connection.commit()
-    except ProgrammingError as e:
-        if "already exists" in str(e.args[0]):
-            print("Database already initialized!")
-        raise
+    connection, cursor = connect_db(config)
+    cursor.execute("SELECT to_regclass('yascheduler_tasks');")
+    if cursor.fetchone()[0] is None:
+        schema = (install_path / "data" / "schema.sql").read_text()
+        for statement in split_sql(schema):
+            cursor.execute(statement)
+        connection.commit()
+    else:
+        print("Database already initialized!")
+
+    # upgrade schema in place
+    version = migrate(connection, cursor)
+    print("Database schema version: {}".format(version))
+    connection.close()
 
 
 def show_nodes():
@@ -278,19 +379,27 @@ def show_nodes():
     yac = Yascheduler(config)
 
     yac.cursor.execute(
-        "SELECT ip, label, task_id FROM yascheduler_tasks WHERE status=%s;",
-        [yac.STATUS_RUNNING],
+        "SELECT ip, label, task_id FROM yascheduler_tasks WHERE status IN (%s, %s);",
+        [yac.STATUS_RUNNING, yac.STATUS_FETCHING],
     )
-    tasks_running = {row[0]: [row[1], row[2]] for row in yac.cursor.fetchall()}
+    tasks_running = {}
+    for row in yac.cursor.fetchall():
+        labels, task_ids = tasks_running.setdefault(row[0], [[], []])
+        labels.append(row[1])
+        task_ids.append(str(row[2]))
 
     yac.cursor.execute("SELECT ip, ncpus, enabled, cloud from yascheduler_nodes;")
     for item in yac.cursor.fetchall():
+        labels, task_ids = tasks_running.get(item[0], [["-"], ["-"]])
         print(
             "ip=%s ncpus=%s enabled=%s occupied_by=%s (task_id=%s) %s"
-            % tuple(
-                [item[0], item[1] or "MAX", item[2]]
-                + tasks_running.get(item[0], ["-", "-"])
-                + [item[3] or ""]
+            % (
+                item[0],
+                item[1] or "MAX",
+                item[2],
+                ",".join(labels),
+                ",".join(task_ids),
+                item[3] or "",
             )
         )
 
@@ -348,8 +457,8 @@ def manage_node():
 
     if args.remove_hard:
         yac.cursor.execute(
-            "SELECT task_id from yascheduler_tasks WHERE ip=%s AND status=%s;",
-            [args.host, yac.STATUS_RUNNING],
+            "SELECT task_id from yascheduler_tasks WHERE ip=%s AND status IN (%s, %s);",
+            [args.host, yac.STATUS_RUNNING, yac.STATUS_FETCHING],
         )
         result = yac.cursor.fetchall() or []
         for (
@@ -372,8 +481,8 @@ def manage_node():
 
     elif args.remove_soft:
         yac.cursor.execute(
-            "SELECT task_id from yascheduler_tasks WHERE ip=%s AND status=%s;",
-            [args.host, yac.STATUS_RUNNING],
+            "SELECT task_id from yascheduler_tasks WHERE ip=%s AND status IN (%s, %s);",
+            [args.host, yac.STATUS_RUNNING, yac.STATUS_FETCHING],
         )
         if yac.cursor.fetchall():
             print("A task associated, prevent from assigning the new tasks")
@@ -401,3 +510,102 @@ def manage_node():
 
     print("Added host to yascheduler: {}".format(args.host))
     return True
+
+
+def rollout():
+    parser = argparse.ArgumentParser(
+        description="Deploy an engine to all the enabled nodes in parallel"
+    )
+    parser.add_argument("engine", help="engine name")
+    parser.add_argument(
+        "-t",
+        "--threads",
+        required=False,
+        default=16,
+        type=int,
+        help="max number of nodes deployed at once",
+    )
+    parser.add_argument(
+        "-u",
+        "--uplinks",
+        required=False,
+        default=1,
+        type=int,
+        help="max number of nodes receiving the engine from this host at once",
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(CONFIG_FILE)
+    yac = Yascheduler(config)
+
+    engine = yac.engines.get(args.engine)
+    if not engine:
+        print("Unknown engine: {}".format(args.engine))
+        return False
+
+    yac.cursor.execute("SELECT ip, cloud FROM yascheduler_nodes WHERE enabled=TRUE;")
+    nodes = {
+        row[0]: config.get("clouds", f"{row[1]}_user", fallback=yac.ssh_user)
+        for row in yac.cursor.fetchall()
+        if "." in row[0]  # NB provision nodes have fake ips
+    }
+    if not nodes:
+        print("No enabled nodes")
+        return False
+
+    try:
+        engine_rollout = EngineRollout(
+            yac,
+            engine,
+            nodes,
+            threads=args.threads,
+            uplinks=args.uplinks,
+            progress=print,
+        )
+    except OSError as err:
+        print("Can't read the engine files: {}".format(err))
+        return False
+    errors = engine_rollout.run()
+    yac.ssh_pool.close()
+    yac.connection.close()
+
+    failed = [ip for ip, err in errors.items() if err]
+    print("Deployed to {} of {} nodes".format(len(nodes) - len(failed), len(nodes)))
+    return not failed
+
+
+def bake():
+    parser = argparse.ArgumentParser(
+        description="Bake the cloud images of the nodes set up for the engines"
+    )
+    parser.add_argument(
+        "clouds", nargs="*", help="cloud providers, all the configured by default"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = ConfigParser()
+    config.read(CONFIG_FILE)
+    yac = Yascheduler(config)
+
+    names = args.clouds
+    if not names and config.has_section("clouds"):
+        names = sorted(
+            set(name.split("_")[0] for name, value in config.items("clouds") if value)
+        )
+    failed = []
+    for name in names:
+        if config.getint("clouds", name + "_max_nodes", fallback=None) == 0:
+            continue
+        try:
+            cloudapi = load_cloudapi(name)(config)
+            cloudapi.yascheduler = yac
+            print("{}: {}".format(name, cloudapi.bake_image()))
+        except Exception as err:
+            print("{}: failed: {}".format(name, err))
+            failed.append(name)
+
+    yac.ssh_pool.close()
+    yac.connection.close()
+    return not failed
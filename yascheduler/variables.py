@@ -9,5 +9,46 @@ LOG_FILE = getenv("YASCHEDULER_LOG_PATH", "/var/log/yascheduler.log")
 PID_FILE = getenv("YASCHEDULER_PID_PATH", "/var/run/yascheduler.pid")
 
 SLEEP_INTERVAL = 6
-N_IDLE_PASSES = 20
+# seconds a cloud node is kept idle before it is removed
+NODE_IDLE_TIMEOUT = 120
+# the idle nodes billed by periods are removed this number of seconds
+# before the next period starts
+NODE_RELEASE_MARGIN = 300
+# seconds the cloud provider nodes are listed anew after
+NODE_INVENTORY_TTL = 600
 DEFAULT_NODES_PER_PROVIDER = 10
+# seconds before a node of inactive daemon can be taken over by another one
+NODE_LEASE_TTL = 120
+# seconds of recent task submissions the warm pool of cloud nodes is sized by
+WARM_POOL_WINDOW = 900
+# expected seconds to create and set up a cloud node, until measured
+NODE_BOOT_TIME = 300
+# expected seconds of a task run, until measured
+TASK_RUNTIME = 3600
+
+# seconds the results of a finished task are tried to be fetched for
+FETCH_TIMEOUT = 3600
+# seconds before the failed results retrieval is retried, doubled every time
+FETCH_RETRY_DELAY = 10
+FETCH_RETRY_MAX_DELAY = 600
+
+# seconds before the failed detection of the node CPUs is retried
+NODE_NCPUS_RETRY_DELAY = 60
+
+# max number of tasks inserted by a single statement
+SUBMIT_BATCH_SIZE = 1000
+
+# process id of the running task, in the task folder on the node
+TASK_PID_FILE = ".yascheduler.pid"
+# hashes of the deployed engine artifacts, in the engine folder on the node
+ENGINE_MANIFEST_FILE = ".yascheduler.manifest.json"
+# hash of the node setup (packages and engines), in the remote data folder
+NODE_IMAGE_FILE = ".yascheduler.image"
+
+# PostgreSQL NOTIFY channel to wake up the scheduler daemon
+NOTIFY_CHANNEL = "yascheduler"
+
+# files of this size and above are downloaded by ranges in parallel
+CHUNKED_DOWNLOAD_THRESHOLD = 256 * 1024 * 1024
+CHUNKED_DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+CHUNKED_DOWNLOAD_THREADS = 4